@@ -1,13 +1,7 @@
 import tkinter as tk
 from tkinter import messagebox, filedialog
 from PIL import Image, ImageTk
-import custom_chaos_implementation as chaos
-import edges as edges
-import emphasize_blue_lsb as blue_lsb
-import improved_lsb as impr_lsb
-import msb_using_bit_differencing as msb
-import rdh_grayscale as rdh
-import standard_lsb as stand_lsb
+import methods
 
 def display_message_window(message):
     message_window = tk.Toplevel()
@@ -51,7 +45,7 @@ def show_help():
         "   - **Description:** MSB method operates by calculating the difference between the 6th and 5th bits of each pixel. Depending on the result of this calculation compared to the bit of the message to be hidden, the 5th bit is either left unchanged or modified to match the message bit.\n\n"
         "6. Edges\n"
         "   - **Hide:** Enter the message to be hidden. Requires an input file (image). Saves edge positions file and stego image to provided directory.\n"
-        "   - **Extract:** Requires an input file (image) and an edge positions file to read the message.\n"
+        "   - **Extract:** Requires an input file (image). Edge positions file is needed only for images hidden by older versions (without edges header).\n"
         "   - **Description:** Edge-based hiding involves embedding data in areas where the gradient falls within a specified threshold. If more data needs to be hidden, the threshold is reduced to allow for embedding additional bits.\n\n"
         "7. Custom Chaos implementation using Henon's algorithm\n"
         "   - **Hide:** Enter the message to be hidden. Requires a cover image.\n"
@@ -91,35 +85,26 @@ def embed_message(method, message=None):
         return  # If user cancels the save dialog, do nothing
 
     try:
+        extra_argument_filepath = None
         if method == "rdh":
             extra_argument_filepath = filedialog.asksaveasfilename(
                 title="Save metadata file",
-                defaultextension=".json",
-                filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+                defaultextension=".rdh",
+                filetypes=[("RDH metadata", "*.rdh"), ("JSON files", "*.json"), ("All files", "*.*")]
             )
-            rdh.embed_message(filepath, message, output_filepath, extra_argument_filepath)
-        elif method == "standard_lsb":
-            stand_lsb.embed_message(filepath, message, output_filepath)
         elif method == "improved_lsb":
             extra_argument_filepath = filedialog.asksaveasfilename(
                 title="Save key file",
                 defaultextension=".key",
                 filetypes=[("Key files", "*.key"), ("All files", "*.*")]
             )
-            impr_lsb.embed_message(filepath, message, output_filepath, extra_argument_filepath)
-        elif method == "emphasize_blue_lsb":
-            blue_lsb.embed_message(filepath, message, output_filepath)
-        elif method == "msb":
-            msb.embed_message(filepath, message, output_filepath)
         elif method == "edges":
             extra_argument_filepath = filedialog.asksaveasfilename(
                 title="Save edge positions file",
                 defaultextension=".txt",
                 filetypes=[("Text file", "*.txt"), ("All files", "*.*")]
-            )
-            edges.embed_message(filepath, message, output_filepath, extra_argument_filepath)
-        elif method == "chaos":
-            chaos.embed_message(filepath, message, output_filepath)
+            ) or None
+        methods.embed(method, filepath, message, output_filepath, extra_argument_filepath)
 
         entry.delete(0, tk.END)
         messagebox.showinfo("Success", "Message successfully hidden.")
@@ -132,33 +117,33 @@ def extract_message(method):
         messagebox.showwarning("No file chosen.", "Please choose a file before running the script.")
         return
     try:
+        module = methods.load_method(method)
         if method == "rdh":
             extra_argument_filepath = filedialog.askopenfilename(
                 title="Choose metadata file",
-                filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+                filetypes=[("RDH metadata", "*.rdh *.json"), ("All files", "*.*")]
             )
-            message = rdh.extract_message(filepath, extra_argument_filepath)
-        elif method == "standard_lsb":
-            message = stand_lsb.extract_message(filepath)
+            recovered_filepath = filedialog.asksaveasfilename(
+                title="Save recovered image (cancel to skip)",
+                defaultextension=".png",
+                filetypes=[("PNG files", "*.png"), ("All files", "*.*")]
+            )
+            message = module.extract_message(filepath, extra_argument_filepath, output_path=recovered_filepath or None)
         elif method == "improved_lsb":
             extra_argument_filepath = filedialog.askopenfilename(
                 title="Choose key file",
                 filetypes=[("Key files", "*.key"), ("All files", "*.*")]
             )
-            message = impr_lsb.extract_message(filepath, extra_argument_filepath)
-        elif method == "emphasize_blue_lsb":
-            message = blue_lsb.extract_message(filepath)
-        elif method == "msb":
-            message = msb.extract_message(filepath)
+            message = module.extract_message(filepath, extra_argument_filepath)
         elif method == "edges":
             extra_argument_filepath = filedialog.askopenfilename(
-                title="Choose edge positions file",
+                title="Choose edge positions file (cancel for images with edges header)",
                 defaultextension=".txt",
                 filetypes=[("Text file", "*.txt"), ("All files", "*.*")]
             )
-            message = edges.extract_message(filepath, extra_argument_filepath)
-        elif method == "chaos":
-            message = chaos.extract_message(filepath)
+            message = module.extract_message(filepath, extra_argument_filepath or None)
+        else:
+            message = module.extract_message(filepath)
 
         display_message_window(message)
     except Exception as e:
@@ -170,26 +155,20 @@ def calculate_capacity(method):
         messagebox.showwarning("No file chosen.", "Please choose a file before running the script.")
         return
     try:
+        capacity = methods.load_method(method).calculate_capacity(filepath)
         if method == "rdh":
-            capacity = rdh.calculate_capacity(filepath)
             rdh_label_result.config(text=capacity)
         elif method == "standard_lsb":
-            capacity = stand_lsb.calculate_capacity(filepath)
             standard_lsb_label_result.config(text=capacity)
         elif method == "improved_lsb":
-            capacity = impr_lsb.calculate_capacity(filepath)
             improved_lsb_label_result.config(text=capacity)
         elif method == "emphasize_blue_lsb":
-            capacity = blue_lsb.calculate_capacity(filepath)
             emphasize_blue_lsb_label_result.config(text=capacity)
         elif method == "msb":
-            capacity = msb.calculate_capacity(filepath)
             msb_label_result.config(text=capacity)
         elif method == "edges":
-            capacity = edges.calculate_capacity(filepath)
             edges_label_result.config(text=capacity)
         elif method == "chaos":
-            capacity = chaos.calculate_capacity(filepath)
             custom_chaos_label_result.config(text=capacity)
     except Exception as e:
         messagebox.showerror("Error", f"An error occurred while calculating capacity: {e}")
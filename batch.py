@@ -0,0 +1,236 @@
+"""Headless batch processing, jobs are run in parallel by a pool of worker processes.
+
+Embedding reads a manifest, CSV with a header row or JSON lines (.jsonl), one job per row:
+
+    image,method,message,message_file,output,sidecar
+    sample_images/test1.png,standard_lsb,Hello,,out/test1.png,
+    sample_images/test2.png,improved_lsb,,sample_text/lorem.txt,out/test2.png,out/test2.key
+
+    python batch.py embed manifest.csv --workers 8
+
+Either message or message_file (hidden as is, binary files work too) is given; sidecar is the metadata/key/edge positions file of methods
+that save one (see methods.SIDECAR_METHODS). Relative paths are resolved against the working directory.
+
+Extraction runs over every image of a directory, hidden with one method. Sidecars are paired by name
+(test1.png -> test1.key, see methods.SIDECAR_EXTENSIONS), results are streamed as JSON lines. Messages
+can be verified against expected plaintexts, <image name without extension>.txt in another directory:
+
+    python batch.py extract out --method improved_lsb --expected plaintexts > results.jsonl
+
+Covers restored by reversible methods (see methods.REVERSIBLE_METHODS) can be checked against the original
+covers, images of the same name in another directory; pixels are compared in memory, nothing is written:
+
+    python batch.py extract out --method rdh --covers sample_images/grayscale > results.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import methods
+from bit_utils import payload_text
+
+MANIFEST_FIELDS = ("image", "method", "message", "message_file", "output", "sidecar")
+
+IMAGE_EXTENSIONS = (".png", ".bmp", ".tif", ".tiff", ".ppm", ".pgm", ".jpg", ".jpeg")
+
+# Methods using OpenCV, which would otherwise start a thread per core in every worker process
+OPENCV_METHODS = {"rdh", "edges"}
+
+def init_worker(uses_opencv):
+    if uses_opencv:
+        import cv2
+        cv2.setNumThreads(1)
+
+def make_pool(jobs, workers):
+    uses_opencv = any(job["method"] in OPENCV_METHODS for job in jobs)
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(uses_opencv,))
+
+def read_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8", newline="") as file:
+        if manifest_path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            rows = list(csv.DictReader(file))
+
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        unknown = set(row) - set(MANIFEST_FIELDS)
+        if unknown:
+            raise ValueError(f"Manifest row {number}: unknown fields {', '.join(sorted(unknown))}.")
+        job = {field: row.get(field) or None for field in MANIFEST_FIELDS}
+        for field in ("image", "method", "output"):
+            if not job[field]:
+                raise ValueError(f"Manifest row {number}: missing {field}.")
+        if (job["message"] is None) == (job["message_file"] is None):
+            raise ValueError(f"Manifest row {number}: exactly one of message and message_file is required.")
+        if job["method"] not in methods.METHOD_MODULES:
+            raise ValueError(f"Manifest row {number}: unknown method '{job['method']}'.")
+        jobs.append(job)
+    return jobs
+
+def run_embed_job(job):
+    """Embeds one manifest job (in a worker process); returns its wall time and error, if any."""
+    start = time.perf_counter()
+    try:
+        output_directory = os.path.dirname(job["output"])
+        if output_directory:
+            os.makedirs(output_directory, exist_ok=True)
+
+        # Message files are streamed into the image rather than read whole
+        if job["message_file"] is not None:
+            methods.embed_file(job["method"], job["image"], job["message_file"], job["output"], job["sidecar"], diagnostics=False)
+        else:
+            methods.embed(job["method"], job["image"], job["message"], job["output"], job["sidecar"], diagnostics=False)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return time.perf_counter() - start, error
+
+def embed_batch(jobs, workers=None, report=print):
+    """Runs embedding jobs over a process pool; returns (job, seconds, error) in manifest order."""
+    results = [None] * len(jobs)
+    with make_pool(jobs, workers) as executor:
+        futures = {executor.submit(run_embed_job, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            job = jobs[index]
+            try:
+                seconds, error = future.result()
+            except Exception as e:
+                # Worker process died (e.g. killed for running out of memory)
+                seconds, error = 0.0, f"{type(e).__name__}: {e}"
+            results[index] = (job, seconds, error)
+
+            status = "FAILED" if error else "ok"
+            line = f"[{index + 1}/{len(jobs)}] {status:6} {seconds:8.3f}s  {job['method']:18} {job['image']} -> {job['output']}"
+            report(f"{line}  ({error})" if error else line)
+    return results
+
+def find_cover(covers_directory, stem):
+    """Original cover of a stego image: first image of the same name in covers_directory, or None."""
+    for extension in IMAGE_EXTENSIONS:
+        cover = os.path.join(covers_directory, stem + extension)
+        if os.path.isfile(cover):
+            return cover
+    return None
+
+def find_extract_jobs(directory, method, expected_directory=None, covers_directory=None):
+    """Pairs every image of a directory with its sidecar, expected plaintext and original cover (None where not found)."""
+    extensions = [methods.SIDECAR_EXTENSIONS[method]] if method in methods.SIDECAR_EXTENSIONS else []
+    if method in methods.OLDER_SIDECAR_EXTENSIONS:
+        extensions.append(methods.OLDER_SIDECAR_EXTENSIONS[method])
+    jobs = []
+    for name in sorted(os.listdir(directory)):
+        stem, image_extension = os.path.splitext(name)
+        if image_extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        sidecars = [os.path.join(directory, stem + extension) for extension in extensions]
+        expected = os.path.join(expected_directory, stem + ".txt") if expected_directory else None
+        jobs.append({
+            "image": os.path.join(directory, name),
+            "method": method,
+            "sidecar": next((sidecar for sidecar in sidecars if os.path.isfile(sidecar)), None),
+            "expected": expected if expected and os.path.isfile(expected) else None,
+            "cover": find_cover(covers_directory, stem) if covers_directory else None,
+        })
+    return jobs
+
+def run_extract_job(job):
+    """Extracts (and verifies) one image in a worker process; returns a JSON-serializable result."""
+    result = {"image": job["image"], "method": job["method"], "sidecar": job["sidecar"]}
+    start = time.perf_counter()
+    try:
+        if job.get("cover") is not None:
+            import cv2
+            import numpy as np
+
+            payload, recovered = methods.recover(job["method"], job["image"], job["sidecar"], as_bytes=True)
+            result["restored"] = bool(np.array_equal(recovered, cv2.imread(job["cover"], cv2.IMREAD_GRAYSCALE)))
+        else:
+            payload = methods.extract(job["method"], job["image"], job["sidecar"], as_bytes=True)
+        result["message"] = payload_text(payload)
+        if job["expected"] is not None:
+            with open(job["expected"], "rb") as file:
+                result["verified"] = payload == file.read()
+        result["error"] = None
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result
+
+def extract_batch(jobs, workers=None):
+    """Yields extraction results in order of jobs, as soon as they are done."""
+    if not jobs:
+        return
+    # Jobs are handed out in chunks, so that many small images don't cost a round trip each
+    chunk_size = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 16))
+    with make_pool(jobs, workers) as executor:
+        yield from executor.map(run_extract_job, jobs, chunksize=chunk_size)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = commands.add_parser("embed", help="hide messages in images listed in a manifest")
+    embed_parser.add_argument("manifest", help="CSV (with header) or JSON lines (.jsonl) manifest")
+    embed_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+
+    extract_parser = commands.add_parser("extract", help="extract messages from all images of a directory")
+    extract_parser.add_argument("directory", help="directory with stego images and their sidecar files")
+    extract_parser.add_argument("--method", required=True, choices=list(methods.METHOD_MODULES))
+    extract_parser.add_argument("--expected", help="directory with expected plaintexts, <image name>.txt")
+    extract_parser.add_argument("--covers", help="directory with original covers, <image name>.<image extension> (reversible methods)")
+    extract_parser.add_argument("--output", help="JSON lines output file (default: standard output)")
+    extract_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        if args.covers and args.method not in methods.REVERSIBLE_METHODS:
+            parser.error(f"--covers is available for reversible methods only: {', '.join(sorted(methods.REVERSIBLE_METHODS))}.")
+        return extract_main(args)
+
+    try:
+        jobs = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(f"Could not read manifest: {e}")
+
+    start = time.perf_counter()
+    results = embed_batch(jobs, args.workers)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for _, _, error in results if error)
+    job_seconds = sum(seconds for _, seconds, _ in results)
+    print(f"\n{len(results)} jobs, {len(results) - failed} succeeded, {failed} failed in {elapsed:.2f}s "
+          f"({(len(results) - failed) / elapsed if elapsed else 0.0:.2f} images/s, "
+          f"{job_seconds / len(results) if results else 0.0:.3f}s per job on average)")
+    return 1 if failed else 0
+
+def extract_main(args):
+    jobs = find_extract_jobs(args.directory, args.method, args.expected, args.covers)
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+
+    start = time.perf_counter()
+    failed = mismatched = unrestored = 0
+    try:
+        for result in extract_batch(jobs, args.workers):
+            failed += result["error"] is not None
+            mismatched += result.get("verified") is False
+            unrestored += result.get("restored") is False
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    restored = f", {unrestored} covers not restored" if args.covers else ""
+    print(f"{len(jobs)} images, {failed} failed, {mismatched} not matching expected plaintext{restored} in {elapsed:.2f}s "
+          f"({len(jobs) / elapsed if elapsed else 0.0:.2f} images/s)", file=sys.stderr)
+    return 1 if failed or mismatched or unrestored else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
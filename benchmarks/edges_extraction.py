@@ -0,0 +1,85 @@
+"""Extraction latency of the edges method: threshold from the image header vs search by edge count.
+
+Every image gets a message embedded, a copy without header (blue component of the cover) is extracted
+through the edge positions file, the way images hidden by older versions are:
+
+    python benchmarks/edges_extraction.py --message-size 1000 sample_images/test1.png
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import cv2
+import edges
+
+def count_canny_calls(function, *args):
+    """Runs function with empty edges caches; returns its wall time and number of Canny passes."""
+    calls = 0
+    canny = edges.canny_edges
+
+    def counting_canny(*canny_args):
+        nonlocal calls
+        calls += 1
+        return canny(*canny_args)
+
+    edges._edge_counts.clear()
+    edges._edge_positions.clear()
+    edges.canny_edges = counting_canny
+    try:
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start, calls
+    finally:
+        edges.canny_edges = canny
+
+def benchmark_image(image_path, message, work_dir, repeat):
+    stego_path = os.path.join(work_dir, "stego.png")
+    legacy_path = os.path.join(work_dir, "legacy.png")
+    edge_positions_file = os.path.join(work_dir, "edges.txt")
+
+    edges.embed_message(image_path, message, stego_path, edge_positions_file, diagnostics=False)
+
+    # Same stego image without header
+    stego = cv2.imread(stego_path)
+    stego[:, :, 0] = cv2.imread(image_path)[:, :, 0]
+    cv2.imwrite(legacy_path, stego)
+
+    results = {}
+    for name, args in (("header", (stego_path,)), ("search", (legacy_path, edge_positions_file))):
+        runs = [count_canny_calls(edges.extract_message, *args) for _ in range(repeat)]
+        results[name] = (statistics.median(run[0] for run in runs), runs[0][1])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="cover images (default: RGB sample images)")
+    parser.add_argument("--message-size", type=int, default=1000, help="message length in chars")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = args.images or sorted(glob.glob(os.path.join(REPO_ROOT, "sample_images", "*.*")))
+    with open(os.path.join(REPO_ROOT, "sample_text", "random_text_mid.txt")) as file:
+        text = file.read()
+    message = (text * (args.message_size // len(text) + 1))[:args.message_size]
+
+    print(f"{'image':<16}{'header [ms]':>13}{'canny':>7}{'search [ms]':>13}{'canny':>7}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for image_path in images:
+            try:
+                results = benchmark_image(image_path, message, work_dir, args.repeat)
+            except Exception as e:
+                print(f"{os.path.basename(image_path):<16} skipped: {e}")
+                continue
+            (header_time, header_calls), (search_time, search_calls) = results["header"], results["search"]
+            print(f"{os.path.basename(image_path):<16}{header_time * 1000:>13.1f}{header_calls:>7}"
+                  f"{search_time * 1000:>13.1f}{search_calls:>7}{search_time / header_time:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
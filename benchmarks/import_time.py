@@ -0,0 +1,72 @@
+"""Cold-start import latency of every method module.
+
+Each module is imported in a fresh interpreter several times and the median wall time is reported.
+With --baseline the same is measured for an older revision (exported with git archive) for comparison:
+
+    python benchmarks/import_time.py --baseline HEAD~1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+METHOD_MODULES = [
+    "standard_lsb",
+    "improved_lsb",
+    "emphasize_blue_lsb",
+    "msb_using_bit_differencing",
+    "edges",
+    "rdh_grayscale",
+    "custom_chaos_implementation",
+]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_import(module, source_dir, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=source_dir, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def measure_all(source_dir, repeat):
+    # Interpreter startup is subtracted, so the numbers show the cost of the import itself
+    startup = measure_import("sys", source_dir, repeat)
+    return {module: measure_import(module, source_dir, repeat) - startup for module in METHOD_MODULES}
+
+def export_revision(revision, target_dir):
+    archive = subprocess.run(["git", "archive", "--format=tar", revision], cwd=REPO_ROOT, check=True, capture_output=True).stdout
+    archive_path = os.path.join(target_dir, "revision.tar")
+    with open(archive_path, "wb") as file:
+        file.write(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(target_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    args = parser.parse_args()
+
+    current = measure_all(REPO_ROOT, args.repeat)
+
+    baseline = None
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as baseline_dir:
+            export_revision(args.baseline, baseline_dir)
+            baseline = measure_all(baseline_dir, args.repeat)
+
+    print(f"{'module':<30}{'current [ms]':>14}" + (f"{'baseline [ms]':>15}{'speedup':>10}" if baseline else ""))
+    for module in METHOD_MODULES:
+        line = f"{module:<30}{current[module] * 1000:>14.1f}"
+        if baseline:
+            line += f"{baseline[module] * 1000:>15.1f}{baseline[module] / current[module]:>9.1f}x"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Size and parse time of RDH metadata files: JSON of older versions against the binary format.
+
+    python benchmarks/rdh_metadata.py --scale 2.2 --block-size 25
+
+Metadata comes from hiding a full-capacity random payload in a grayscale sample image (scaled up, 2.2 times
+per side of test7.png is about 40 MP), then it's saved as JSON, binary and zlib-compressed binary and each
+file is read back by read_extract_data.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+import rdh_grayscale
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", default=os.path.join(REPO_ROOT, "sample_images", "grayscale", "grayscale_test7.png"))
+    parser.add_argument("--scale", type=float, default=1.0, help="image size relative to the sample (per side)")
+    parser.add_argument("--block-size", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    image = Image.open(args.image).convert("L")
+    if args.scale != 1:
+        image = image.resize((round(image.width * args.scale), round(image.height * args.scale)), Image.LANCZOS)
+    pixels = np.asarray(image)
+
+    capacity = rdh_grayscale.calculate_max_message_length(pixels, args.block_size)
+    secret_bits = np.random.default_rng(0).integers(0, 2, capacity, dtype=np.uint8)
+    _, peak_zero_positions, _ = rdh_grayscale.shift_and_embed(pixels, args.block_size, secret_bits)
+    print(f"{image.width}x{image.height}, block size {args.block_size}: {len(peak_zero_positions)} visited blocks, "
+          f"{sum(entry is not None for entry in peak_zero_positions)} used, {capacity} bits hidden")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = {
+            "json": (os.path.join(work_dir, "metadata.json"), True),
+            "binary": (os.path.join(work_dir, "metadata.rdh"), False),
+            "binary+zlib": (os.path.join(work_dir, "metadata_zlib.rdh"), True),
+        }
+        print(f"{'format':<14}{'size [B]':>12}{'read [ms]':>12}")
+        for name, (path, compress) in files.items():
+            rdh_grayscale.store_extract_data(peak_zero_positions, capacity, 0, args.block_size, path, compress=compress)
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rdh_grayscale.read_extract_data(path)
+                times.append(time.perf_counter() - start)
+            print(f"{name:<14}{os.path.getsize(path):>12}{min(times) * 1000:>12.2f}")
+
+if __name__ == "__main__":
+    main()
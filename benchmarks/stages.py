@@ -0,0 +1,54 @@
+"""Time and memory of every stage of one embedding and extraction.
+
+    python benchmarks/stages.py standard_lsb sample_images/test2.png --message-size 100000 --cprofile embed.prof
+
+The cProfile dump (of embedding) can be inspected with `python -m pstats embed.prof` or snakeviz.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import methods
+from profiling import profile
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("method", choices=list(methods.METHOD_MODULES))
+    parser.add_argument("image", help="cover image")
+    parser.add_argument("--message-size", type=int, default=1000, help="message length in chars")
+    parser.add_argument("--diagnostics", action="store_true", help="include plots of the method")
+    parser.add_argument("--no-memory", action="store_true", help="don't trace allocations (tracing slows Python code down)")
+    parser.add_argument("--cprofile", help="dump cProfile statistics of embedding to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.path.join(REPO_ROOT, "sample_text", "random_text_large.txt"), "r") as file:
+        text = file.read()
+    message = (text * (args.message_size // len(text) + 1))[:args.message_size]
+
+    # Modules are imported before profiling, so their import time isn't counted
+    methods.load_method(args.method)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        stego_path = os.path.join(work_dir, "stego.png")
+        sidecar_path = None
+        if args.method in methods.SIDECAR_METHODS:
+            sidecar_path = os.path.join(work_dir, "sidecar" + methods.SIDECAR_EXTENSIONS[args.method])
+
+        with profile(memory=not args.no_memory, cprofile_path=args.cprofile) as embedding:
+            methods.embed(args.method, args.image, message, stego_path, sidecar_path, diagnostics=args.diagnostics)
+        with profile(memory=not args.no_memory) as extraction:
+            methods.extract(args.method, stego_path, sidecar_path)
+
+    if args.json:
+        print(json.dumps({"embed": embedding.as_dict(), "extract": extraction.as_dict()}, indent=1))
+    else:
+        print(f"Embedding\n{embedding}\n\nExtraction\n{extraction}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Capacity, embedding and extraction benchmark of every method over the sample images.
+
+Every case (method, image, scale, payload fraction) runs in a fresh process, so its peak RSS isn't
+inflated by earlier cases. Payload is a fraction of the capacity reported by calculate_capacity,
+throughput is decoded cover size divided by wall time. Results are saved as JSON, a previous result
+file (e.g. from another commit) can be compared against:
+
+    python benchmarks/suite.py --output benchmarks/results/before.json
+    python benchmarks/suite.py --methods standard_lsb msb --fractions 0.1 0.9 --compare benchmarks/results/before.json
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Results are kept out of the working tree root (benchmarks/results/ is ignored by git)
+RESULTS_DIRECTORY = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+import methods
+
+# Method name (see methods.METHOD_MODULES) -> sample images it is measured on
+METHOD_IMAGES = {
+    "standard_lsb": "sample_images/*.*",
+    "improved_lsb": "sample_images/*.*",
+    "emphasize_blue_lsb": "sample_images/*.*",
+    "msb": "sample_images/*.*",
+    "edges": "sample_images/*.*",
+    "rdh": "sample_images/grayscale/*.*",
+    "chaos": "sample_images/*.*",
+}
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Not available on Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def capacity_bytes(method, image_path):
+    capacity = int(re.search(r"(\d+) bytes", methods.load_method(method).calculate_capacity(image_path)).group(1))
+    if method == "improved_lsb":
+        # Reported capacity counts 3 bits per pixel but one is used, and the message is hidden as a Fernet
+        # token: 57 bytes of overhead plus the message padded to 16 bytes
+        capacity = (capacity + 8) // 3 - 8 - 57 - 16
+    return max(capacity, 0)
+
+def scaled_cover(image_path, scale, work_dir):
+    if scale == 1:
+        return image_path
+    from PIL import Image
+
+    image = Image.open(image_path)
+    width, height = image.size
+    scaled_path = os.path.join(work_dir, f"cover_{scale}_{os.path.splitext(os.path.basename(image_path))[0]}.png")
+    image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS).save(scaled_path)
+    return scaled_path
+
+def run_case(case):
+    """Measures one case; runs in its own process."""
+    from PIL import Image
+
+    method, image_path, scale, fraction, text, repeat = (case[key] for key in ("method", "image", "scale", "fraction", "text", "repeat"))
+    result = {key: case[key] for key in ("method", "image", "scale", "fraction")}
+    module = methods.load_method(method)
+    result["baseline_rss_mb"] = peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            cover_path = scaled_cover(image_path, scale, work_dir)
+            image = Image.open(cover_path)
+            result["width"], result["height"] = image.size
+            cover_mb = image.size[0] * image.size[1] * len(image.getbands()) / 2**20
+
+            start = time.perf_counter()
+            module.calculate_capacity(cover_path)
+            result["capacity_s"] = time.perf_counter() - start
+
+            capacity = capacity_bytes(method, cover_path)
+            message = (text * (int(capacity * fraction) // len(text) + 1))[:int(capacity * fraction)]
+            result["capacity_chars"], result["message_chars"] = capacity, len(message)
+
+            stego_path = os.path.join(work_dir, "stego.png")
+            sidecar_path = os.path.join(work_dir, "sidecar" + methods.SIDECAR_EXTENSIONS.get(method, ""))
+            sidecar_path = sidecar_path if method in methods.SIDECAR_METHODS else None
+
+            embed_times, extract_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                methods.embed(method, cover_path, message, stego_path, sidecar_path, diagnostics=False)
+                embed_times.append(time.perf_counter() - start)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extracted = methods.extract(method, stego_path, sidecar_path)
+                extract_times.append(time.perf_counter() - start)
+
+            result["embed_s"], result["extract_s"] = statistics.median(embed_times), statistics.median(extract_times)
+            result["embed_mb_s"] = cover_mb / result["embed_s"]
+            result["extract_mb_s"] = cover_mb / result["extract_s"]
+            result["round_trip_ok"] = extracted == message
+            result["error"] = None
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def case_key(result):
+    return (result["method"], os.path.basename(result["image"]), result["scale"], result["fraction"])
+
+def print_results(results, baseline=None):
+    previous = {case_key(result): result for result in baseline or [] if not result.get("error")}
+    print(f"{'method':<20}{'image':<24}{'scale':>6}{'fraction':>9}{'chars':>9}{'embed MB/s':>12}{'extract MB/s':>14}{'peak RSS MB':>13}"
+          + (f"{'embed':>9}{'extract':>9}" if baseline else ""))
+    for result in results:
+        line = f"{result['method']:<20}{os.path.basename(result['image']):<24}{result['scale']:>6}{result['fraction']:>9}"
+        if result["error"]:
+            print(f"{line}  failed: {result['error']}")
+            continue
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "-"
+        line += f"{result['message_chars']:>9}{result['embed_mb_s']:>12.2f}{result['extract_mb_s']:>14.2f}{rss:>13}"
+        if not result["round_trip_ok"]:
+            line += "  (extracted message differs)"
+        old = previous.get(case_key(result))
+        if old:
+            # Speedup against the compared results, above 1 is faster now
+            line += f"{old['embed_s'] / result['embed_s']:>8.2f}x{old['extract_s'] / result['extract_s']:>8.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--methods", nargs="+", choices=list(METHOD_IMAGES), default=list(METHOD_IMAGES))
+    parser.add_argument("--images", nargs="+", help="cover images used for every method (default: sample images)")
+    parser.add_argument("--scales", nargs="+", type=float, default=[1.0], help="cover resize factors")
+    parser.add_argument("--fractions", nargs="+", type=float, default=[0.1, 0.5, 0.9], help="payload as fraction of capacity")
+    parser.add_argument("--repeat", type=int, default=3, help="embed/extract runs per case (median is reported)")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIRECTORY, "benchmark_results.json"),
+                        help="JSON results file (default: benchmarks/results/benchmark_results.json)")
+    parser.add_argument("--compare", help="JSON results file to compare against")
+    args = parser.parse_args()
+
+    with open(os.path.join(REPO_ROOT, "sample_text", "random_text_large.txt"), "r") as file:
+        text = file.read()
+
+    cases = []
+    for method in args.methods:
+        images = args.images or sorted(glob.glob(os.path.join(REPO_ROOT, METHOD_IMAGES[method])))
+        for image_path in images:
+            for scale in args.scales:
+                for fraction in args.fractions:
+                    cases.append({"method": method, "image": image_path, "scale": scale, "fraction": fraction,
+                                  "text": text, "repeat": args.repeat})
+
+    # One process per case, one at a time, so that measurements don't disturb each other
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        results = list(executor.map(run_case, cases))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+
+    output_directory = os.path.dirname(args.output)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump({"revision": git_revision(), "python": sys.version.split()[0], "results": results}, file, indent=1)
+    print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
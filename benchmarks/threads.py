@@ -0,0 +1,93 @@
+"""Speedup of tiled multi-threaded embedding and extraction against the single-threaded engine.
+
+    python benchmarks/threads.py --scale 4 --workers 1 2 4 8
+    python benchmarks/threads.py --methods rdh --scale 1
+
+Covers are sample images (scaled up for huge carriers; test2.png, or the grayscale set for RDH) saved as PPM
+by default, so that the carrier is memory mapped and PNG encoding, which runs on one thread, doesn't hide the
+speedup (RDH covers stay grayscale PNG). Payload is random bytes filling a fraction of the capacity. Times
+are summed over the images; besides whole calls, time of the embed/extract stages alone is reported.
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import methods
+from profiling import profile
+from suite import METHOD_IMAGES, capacity_bytes
+
+def make_cover(image_path, scale, mode, cover_path):
+    from PIL import Image
+
+    image = Image.open(image_path).convert(mode)
+    width, height = image.size
+    if scale != 1:
+        image = image.resize((round(width * scale), round(height * scale)), Image.LANCZOS)
+    image.save(cover_path)
+    return cover_path
+
+def best_run(function, repeat):
+    """(seconds of whole call, seconds of its embed/extract stage), each the best of repeat runs."""
+    call_times, stage_times = [], []
+    for _ in range(repeat):
+        with profile(memory=False) as result:
+            start = time.perf_counter()
+            function()
+            call_times.append(time.perf_counter() - start)
+        totals = result.totals()
+        stage_times.append(sum(totals[name].seconds for name in ("embed", "extract") if name in totals))
+    return min(call_times), min(stage_times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--methods", nargs="+", choices=sorted(methods.THREADED_METHODS), default=sorted(methods.THREADED_METHODS))
+    parser.add_argument("--images", nargs="+", help="cover images (default: test2.png, grayscale set for RDH)")
+    parser.add_argument("--scale", type=float, default=2.0, help="cover size relative to the image (per side)")
+    parser.add_argument("--format", default="ppm", choices=["ppm", "bmp", "tif", "png"], help="format of the cover and stego image")
+    parser.add_argument("--fraction", type=float, default=1.0, help="payload size as fraction of capacity")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if 1 not in args.workers:
+        args.workers.insert(0, 1)  # Single-threaded engine is the baseline
+
+    print(f"{os.cpu_count()} CPUs, covers scaled x{args.scale}")
+    print(f"{'method':<20}{'images':>7}{'workers':>8}{'embed [s]':>11}{'speedup':>9}{'stage':>9}{'extract [s]':>13}{'speedup':>9}{'stage':>9}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for method in args.methods:
+            image_format, mode = ("png", "L") if method == "rdh" else (args.format, "RGB")
+            image_paths = args.images or sorted(glob.glob(os.path.join(REPO_ROOT, METHOD_IMAGES[method] if method == "rdh" else "sample_images/test2.png")))
+            stego_path = os.path.join(work_dir, f"stego.{image_format}")
+            sidecar_path = os.path.join(work_dir, "sidecar" + methods.SIDECAR_EXTENSIONS[method]) if method in methods.SIDECAR_METHODS else None
+
+            cases = []
+            for image_path in image_paths:
+                cover_path = make_cover(image_path, args.scale, mode, os.path.join(work_dir, f"{method}_cover{len(cases)}.{image_format}"))
+                capacity = int(capacity_bytes(method, cover_path) * args.fraction)
+                if capacity > 0:
+                    cases.append((cover_path, os.urandom(capacity)))
+
+            baseline = None
+            for workers in args.workers:
+                embed, extract = [0.0, 0.0], [0.0, 0.0]
+                for cover_path, payload in cases:
+                    times = best_run(lambda: methods.embed(method, cover_path, payload, stego_path, sidecar_path, diagnostics=False, workers=workers), args.repeat)
+                    embed = [total + seconds for total, seconds in zip(embed, times)]
+                    times = best_run(lambda: methods.extract(method, stego_path, sidecar_path, as_bytes=True, workers=workers), args.repeat)
+                    extract = [total + seconds for total, seconds in zip(extract, times)]
+                    if methods.extract(method, stego_path, sidecar_path, as_bytes=True, workers=workers) != payload:
+                        raise SystemExit(f"{method} with {workers} workers: extracted payload differs for {cover_path}.")
+
+                baseline = baseline or embed + extract
+                speedups = [baseline[i] / value if value else float("nan") for i, value in enumerate(embed + extract)]
+                print(f"{method:<20}{len(cases):>7}{workers:>8}{embed[0]:>11.3f}{speedups[0]:>8.2f}x{speedups[1]:>8.2f}x"
+                      f"{extract[0]:>13.3f}{speedups[2]:>8.2f}x{speedups[3]:>8.2f}x")
+
+if __name__ == "__main__":
+    main()
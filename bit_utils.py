@@ -0,0 +1,220 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
+import numpy as np
+
+# Number of carrier values decoded at once during extraction; tiles processed on a thread pool are larger,
+# so that the work on a tile outweighs handing it to a thread
+CHUNK_SIZE = 8 * 32768
+THREAD_TILE_SIZE = 4 * CHUNK_SIZE
+
+# Payload frame: magic, payload length (4 bytes, big-endian) and the payload. Messages hidden by older
+# versions end with a NUL byte instead; none of them starts with the magic, as NUL can't be their first byte.
+FRAME_MAGIC = b'\0STG'
+FRAME_HEADER_SIZE = len(FRAME_MAGIC) + 4
+
+# Bytes read from a payload stream at once while hiding it
+PAYLOAD_CHUNK_SIZE = 1 << 16
+
+def payload_bytes(message):
+    """Message as bytes; text is encoded as UTF-8, file-like objects are read to the end."""
+    if hasattr(message, 'read'):
+        message = message.read()
+    if isinstance(message, str):
+        return message.encode('utf-8')
+    return bytes(message)
+
+def payload_text(payload):
+    """Extracted payload as text; payloads which aren't valid UTF-8 (older messages, binary data) are read as Latin-1."""
+    try:
+        return payload.decode('utf-8')
+    except UnicodeDecodeError:
+        return payload.decode('latin-1')
+
+def frame_header(payload_length):
+    if payload_length >= 2**32:
+        raise ValueError("Payload is too large, at most 4 GiB can be hidden.")
+    return np.frombuffer(FRAME_MAGIC + payload_length.to_bytes(4, 'big'), dtype=np.uint8)
+
+def frame_payload(payload):
+    """Payload with frame header, as uint8 array."""
+    return np.concatenate((frame_header(len(payload)), np.frombuffer(payload, dtype=np.uint8)))
+
+def payload_length(message):
+    """Length of the payload in bytes without reading it, None for streams which can't tell (pipes, sockets)."""
+    if not hasattr(message, 'read'):
+        return len(payload_bytes(message))
+    if isinstance(message, io.TextIOBase):
+        return None  # Length of encoded text isn't known before reading it
+    try:
+        if message.seekable():
+            position = message.tell()
+            return message.seek(0, io.SEEK_END) - message.seek(position)
+    except (AttributeError, OSError):
+        pass
+    return None
+
+def check_capacity(message, capacity):
+    """Raises ValueError if a message of known length (see payload_length) doesn't fit, before anything is
+    written; streams which can't tell their length are checked while being read (see framed_chunks)."""
+    length = payload_length(message)
+    if length is not None and length > capacity:
+        raise ValueError(f"Couldn't embed {length} bytes in the image. Max capacity is: {capacity}.")
+
+def framed_chunks(message, capacity=None, chunk_size=PAYLOAD_CHUNK_SIZE):
+    """Yields (byte offset, uint8 chunk) of the framed message, so that it can be hidden piece by piece.
+
+    Text and bytes come as a single chunk. Streams are read chunk by chunk and the frame header, which
+    holds the length known only at the end, comes last. Capacity (payload bytes, None if unknown) is
+    checked on the way, a stream that doesn't fit fails as soon as it's read past the capacity.
+    """
+    if not hasattr(message, 'read'):
+        payload = payload_bytes(message)
+        if capacity is not None and len(payload) > capacity:
+            raise ValueError(f"Couldn't embed {len(payload)} bytes in the image. Max capacity is: {capacity}.")
+        yield 0, frame_payload(payload)
+        return
+
+    length = 0
+    while True:
+        chunk = message.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if capacity is not None and length + len(chunk) > capacity:
+            raise ValueError(f"Couldn't embed the payload, it's longer than image capacity ({capacity} bytes).")
+        yield FRAME_HEADER_SIZE + length, np.frombuffer(chunk, dtype=np.uint8)
+        length += len(chunk)
+    yield 0, frame_header(length)
+
+def iter_chunks(values, chunk_size=CHUNK_SIZE):
+    """Yields consecutive slices of a flat array (views, nothing is copied)."""
+    for start in range(0, len(values), chunk_size):
+        yield values[start:start + chunk_size]
+
+def flat_tile_bands(pixels, start=0, stop=None, tile_size=CHUNK_SIZE):
+    """Yields (index, rows, low, high) of consecutive runs of pixels.reshape(-1)[start:stop], index counted from start.
+
+    Every run is pixels[rows].reshape(-1)[low:high] - whole rows of pixels (except at start and stop),
+    about tile_size values each.
+    """
+    row_size = pixels[0].size if len(pixels) else 1
+    stop = pixels.size if stop is None else min(stop, pixels.size)
+    rows_per_tile = max(tile_size // row_size, 1)
+    for row in range(start // row_size, -(-stop // row_size), rows_per_tile):
+        rows = slice(row, min(row + rows_per_tile, len(pixels)))
+        band_start = row * row_size
+        low, high = max(start - band_start, 0), min(stop - band_start, (rows.stop - row) * row_size)
+        yield band_start + low - start, rows, low, high
+
+def iter_flat_tiles(pixels, start=0, stop=None, write_back=False, tile_size=CHUNK_SIZE):
+    """Yields (index, values): consecutive runs of pixels.reshape(-1)[start:stop] (see flat_tile_bands).
+
+    Runs are views of pixels when its rows are contiguous (arrays, mapped PPM and TIFF); otherwise (mapped BMP,
+    stored bottom-up in BGR) they are copies, which are written back to pixels after the loop body if write_back is set.
+    """
+    for index, rows, low, high in flat_tile_bands(pixels, start, stop, tile_size):
+        band = pixels[rows]
+        values = band.reshape(-1)
+        yield index, values[low:high]
+        if write_back and not np.may_share_memory(values, band):
+            band[...] = values.reshape(band.shape)
+
+def run_tiles(function, pixels, start=0, stop=None, write_back=False, workers=1, tile_size=None):
+    """Yields function(index, values) for the runs of iter_flat_tiles, in order.
+
+    With more workers runs are processed concurrently on a thread pool (NumPy releases the GIL in array
+    operations), at most two runs per worker ahead of the consumer, so one that stops early (extraction at the
+    end of message) doesn't pay for the rest of the image. Runs are bands of different rows, function can
+    change them in place.
+    """
+    def process(band):
+        index, rows, low, high = band
+        tile = pixels[rows]
+        values = tile.reshape(-1)
+        result = function(index, values[low:high])
+        if write_back and not np.may_share_memory(values, tile):
+            tile[...] = values.reshape(tile.shape)
+        return result
+
+    if tile_size is None:
+        tile_size = THREAD_TILE_SIZE if workers > 1 else CHUNK_SIZE
+    bands = flat_tile_bands(pixels, start, stop, tile_size)
+    if workers <= 1:
+        yield from map(process, bands)
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        try:
+            for band in bands:
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(process, band))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def edit_tiles(function, pixels, start=0, stop=None, workers=1):
+    """Calls function(index, values) for the runs of iter_flat_tiles to change them in place (see run_tiles)."""
+    for _ in run_tiles(function, pixels, start, stop, write_back=True, workers=workers):
+        pass
+
+def read_bytes_until_terminator(byte_chunks):
+    """Collects bytes from a stream of uint8 chunks until the first NUL byte."""
+    message = bytearray()
+    for chunk in byte_chunks:
+        chunk = np.asarray(chunk, dtype=np.uint8).tobytes()
+
+        # Check for end of message
+        end = chunk.find(b'\0')
+        if end != -1:
+            message += chunk[:end]
+            break
+        message += chunk
+
+    return bytes(message)
+
+def pack_bit_chunks(bit_chunks):
+    """Packs a stream of 0/1 chunks into a stream of uint8 chunks.
+
+    Chunks don't have to be byte-aligned, remaining bits are carried over to the next chunk.
+    Trailing bits which don't form a full byte are dropped.
+    """
+    leftover = np.empty(0, dtype=np.uint8)
+    for chunk in bit_chunks:
+        bits = np.concatenate((leftover, chunk)) if len(leftover) else chunk
+        usable = len(bits) - len(bits) % 8
+        leftover = bits[usable:]
+        yield np.packbits(bits[:usable])
+
+def read_frame(byte_chunks):
+    """Reads a framed payload from a stream of uint8 chunks, only as far as needed.
+
+    Streams without frame magic are read as NUL-terminated messages of older versions.
+    """
+    byte_chunks = iter(byte_chunks)
+    data = bytearray()
+    for chunk in byte_chunks:
+        data += np.asarray(chunk, dtype=np.uint8).tobytes()
+        if len(data) >= FRAME_HEADER_SIZE:
+            break
+
+    if len(data) < FRAME_HEADER_SIZE or not data.startswith(FRAME_MAGIC):
+        return read_bytes_until_terminator(itertools.chain([np.frombuffer(bytes(data), dtype=np.uint8)], byte_chunks))
+
+    end = FRAME_HEADER_SIZE + int.from_bytes(data[len(FRAME_MAGIC):FRAME_HEADER_SIZE], 'big')
+    while len(data) < end:
+        chunk = next(byte_chunks, None)
+        if chunk is None:
+            raise ValueError(f"Payload is truncated, image holds {len(data) - FRAME_HEADER_SIZE} of {end - FRAME_HEADER_SIZE} bytes.")
+        data += np.asarray(chunk, dtype=np.uint8).tobytes()
+    return bytes(data[FRAME_HEADER_SIZE:end])
+
+def read_bit_frame(bit_chunks):
+    """Reads a framed payload from a stream of 0/1 chunks (see read_frame)."""
+    return read_frame(pack_bit_chunks(bit_chunks))
@@ -1,40 +1,110 @@
+from diagnostics import compare_images
+from bit_utils import FRAME_HEADER_SIZE, framed_chunks, iter_chunks, payload_text, read_bit_frame
+from profiling import stage
 from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
 
 def calculate_capacity(image_path):
     image = Image.open(image_path)
-    points = henon_map(image.size, a=1.4, b=0.3, x0=0.1, y0=0.3)
-    return f"Maximum message size is {(len(points)//8)-1} chars. (remember about time-limitation)"
+    points = henon_points(*image.size, a=1.4, b=0.3, x0=0.1, y0=0.3)
+    return f"Maximum message size is {max((len(points)//8)-FRAME_HEADER_SIZE, 0)} bytes. (remember about time-limitation)"
+
+# Number of Henon's iterations computed at once; walk starts with small chunks which grow up to this size
+HENON_CHUNK_SIZE = 1 << 20
+HENON_FIRST_CHUNK_SIZE = 1 << 12
+
+# Complete point maps by (width, height, a, b, x0, y0), only a few most recent are kept
+POINT_MAPS_CACHED = 4
+_point_maps = {}
+
+def _cache_point_map(key, points):
+    points.flags.writeable = False
+    if len(_point_maps) >= POINT_MAPS_CACHED:
+        _point_maps.pop(next(iter(_point_maps)))
+    _point_maps[key] = points
+    return points
+
+def iter_henon_points(width, height, a=1.4, b=0.3, x0=0.1, y0=0.3):
+    """Yields unique points of Henon's trajectory normalized to image resolution, in order of appearance.
+
+    Points are flat pixel indices (y * width + x), yielded in chunks computed only when requested,
+    so consumers that stop early don't pay for the whole walk. A walk run to the end is cached.
+    """
+    key = (width, height, a, b, x0, y0)
+    if key in _point_maps:
+        yield from iter_chunks(_point_maps[key])
+        return
 
-def henon_map(image_size, a=1.4, b=0.3, x0=0.1, y0=0.3):
-    x, y = x0, y0
-    points = set()
-    normalized_points = []
+    attempts = width * height
+    visited = np.zeros(attempts, dtype=bool)
+    index_type = np.int32 if attempts < 2**31 else np.int64
+    unique_points = []
 
-    attempts = 0
-    width, height = image_size
-    while attempts < width * height:
-        # Generate Henon's points
-        x_new = 1 - a * x**2 + y
-        y_new = b * x
-        x, y = x_new, y_new
+    x, y = x0, y0
+    x_values = np.empty(min(HENON_CHUNK_SIZE, attempts))
+    start, chunk_size = 0, HENON_FIRST_CHUNK_SIZE
+    while start < attempts:
+        count = min(chunk_size, attempts - start)
+
+        # Generate Henon's points (sequential, y of every point is b * previous x)
+        previous_x = x
+        for i in range(count):
+            x, y = 1 - a * x**2 + y, b * x
+            x_values[i] = x
+        chunk_x = x_values[:count]
+        chunk_y = b * np.concatenate(([previous_x], chunk_x[:-1]))
 
         # Normalize points to image resolution
-        x_norm = int((x + 1.5) * (width // 3)) % width
-        y_norm = int((y + 1.5) * (height // 3)) % height
-
-        # Add only unique points to list
-        if (x_norm, y_norm) not in points:
-            points.add((x_norm, y_norm))
-            normalized_points.append((x_norm, y_norm))
-
-        attempts += 1
+        x_norm = ((chunk_x + 1.5) * (width // 3)).astype(np.int64) % width
+        y_norm = ((chunk_y + 1.5) * (height // 3)).astype(np.int64) % height
+        indices = y_norm * width + x_norm
+
+        # Add only unique points, in order of their first appearance
+        chunk_points, first_positions = np.unique(indices, return_index=True)
+        first_positions = np.sort(first_positions[~visited[chunk_points]])
+        new_points = indices[first_positions].astype(index_type)
+        visited[new_points] = True
+        unique_points.append(new_points)
+        if len(new_points):
+            yield new_points
+
+        start += count
+        chunk_size = min(chunk_size * 2, HENON_CHUNK_SIZE)
+
+    _cache_point_map(key, np.concatenate(unique_points) if unique_points else np.empty(0, dtype=index_type))
+
+def henon_points(width, height, a=1.4, b=0.3, x0=0.1, y0=0.3):
+    """All unique points of Henon's trajectory as flat pixel indices (cached, must not be modified)."""
+    key = (width, height, a, b, x0, y0)
+    if key not in _point_maps:
+        for _ in iter_henon_points(width, height, a, b, x0, y0):
+            pass
+    return _point_maps[key]
+
+def take_henon_points(point_chunks, count, pending):
+    """Next count points from chunks of iter_henon_points (fewer if trajectory ends); returns them and the
+    unused rest of the last chunk, which has to be passed to the next call."""
+    taken = [pending[:count]]
+    found = len(taken[0])
+    pending = pending[count:]
+    while found < count:
+        chunk = next(point_chunks, None)
+        if chunk is None:
+            break
+        taken.append(chunk[:count - found])
+        pending = chunk[count - found:]
+        found += len(taken[-1])
+    return np.concatenate(taken), pending
 
-    return normalized_points
+def henon_map(image_size, a=1.4, b=0.3, x0=0.1, y0=0.3):
+    width, height = image_size
+    points = henon_points(width, height, a, b, x0, y0)
+    return list(zip((points % width).tolist(), (points // width).tolist()))
 
 
 def plot_henon(points):
+    import matplotlib.pyplot as plt
+
     if not points:
         print("No points to plot.")
         return
@@ -47,71 +117,59 @@ def plot_henon(points):
     plt.grid()
     plt.show()
 
-def embed_message(cover_image_path, secret_message, output_path, a=1.4, b=0.3, x0=0.1, y0=0.3):
-    image = Image.open(cover_image_path)
-    pixels = np.array(image)
-
-    secret_bits = ''.join(format(ord(char), '08b') for char in secret_message + '\0')
-
-    points = henon_map(image.size, a, b, x0, y0)
-    
-    if len(points) < len(secret_bits):
-        raise Exception(f"Could not embed secret message ({len(secret_message)} chars). Max capacity is {len(points)//8} chars.")
+def embed_message(cover_image_path, secret_message, output_path, a=1.4, b=0.3, x0=0.1, y0=0.3, diagnostics=True):
+    with stage("load"):
+        image = Image.open(cover_image_path)
+        pixels = np.array(image)
+
+    if diagnostics:
+        with stage("diagnostics"):
+            plot_henon(henon_map(image.size, a, b, x0, y0))
+
+    # Points of the frame header are kept aside, stream payloads get their header written last
+    with stage("locate-carriers"):
+        point_chunks = iter_henon_points(*image.size, a, b, x0, y0)
+        header_points, pending = take_henon_points(point_chunks, FRAME_HEADER_SIZE * 8, np.empty(0, dtype=np.int64))
+    walked = len(header_points)
+
+    # Message (text, bytes or binary stream read piece by piece) is hidden chunk by chunk, trajectory is
+    # walked only as far as the message reaches
+    carriers = pixels.reshape(-1, pixels.shape[-1])
+    for offset, chunk in framed_chunks(secret_message):
+        with stage("encode-payload"):
+            secret_bits = np.unpackbits(chunk)
+
+        with stage("locate-carriers"):
+            start, end = offset * 8, offset * 8 + len(secret_bits)
+            next_points, pending = take_henon_points(point_chunks, max(end - max(start, len(header_points)), 0), pending)
+            walked += len(next_points)
+            targets = np.concatenate((header_points[start:end], next_points))
+
+        if len(targets) < len(secret_bits):
+            raise Exception(f"Could not embed secret message, Henon's trajectory has only {walked} points. Max capacity is {max(walked//8 - FRAME_HEADER_SIZE, 0)} bytes.")
+
+        # Modify LSB for Blue at consecutive points
+        with stage("embed"):
+            carriers[targets, 2] = (carriers[targets, 2] & 0b11111110) | secret_bits
+
+    with stage("encode-output"):
+        stego_image = Image.fromarray(pixels)
+        stego_image.save(output_path)
     
-    plot_henon(points)
+    return compare_images(cover_image_path, output_path, diagnostics)
 
-    for i in range(len(secret_bits)):
-        x, y = points[i]
+def extract_bytes(stego_image_path, a=1.4, b=0.3, x0=0.1, y0=0.3):
+    with stage("load"):
+        image = Image.open(stego_image_path)
+        pixels = np.array(image)
 
-        r, g, b = pixels[y, x]
-        b = (b & 0b11111110) | int(secret_bits[i])  # modify LSB for Blue
-        pixels[y, x] = (r, g, b)
-
-    stego_image = Image.fromarray(pixels)
-    stego_image.save(output_path)
-    
-    compare_images(cover_image_path, output_path)
+    # Read LSB of Blue at consecutive points until end of message, points are generated on demand
+    with stage("extract"):
+        blue = pixels.reshape(-1, pixels.shape[-1])[:, 2]
+        bits = (blue[chunk] & 1 for chunk in iter_henon_points(*image.size, a, b, x0, y0))
+        return read_bit_frame(bits)
 
 def extract_message(stego_image_path, a=1.4, b=0.3, x0=0.1, y0=0.3):
-    image = Image.open(stego_image_path)
-    pixels = np.array(image)
-
-    points = henon_map(image.size, a, b, x0, y0)
-
-    bits = []
-    for i in range(len(points)):
-        x, y = points[i]
-
-        _, _, b = pixels[y, x]
-        bits.append(str(b & 1))
-
-        if len(bits) >= 8 and ''.join(bits[-8:]) == '00000000':
-            break
-
-    secret_bits = ''.join(bits)
-    message = ''.join(chr(int(secret_bits[i:i+8], 2)) for i in range(0, len(secret_bits) - 8, 8))
-
-    return message
-
-def compare_images(image_path1, image_path2):
-    image1 = Image.open(image_path1)
-    image2 = Image.open(image_path2)
-
-    if image1.size != image2.size:
-        raise ValueError("Images need to be same size.")
-    
-    # Convert images to  NumPy arrays
-    pixels1 = np.array(image1)
-    pixels2 = np.array(image2)
-
-    differences = np.bitwise_xor(pixels1, pixels2)
-    bit_differences = np.unpackbits(differences, axis=-1).sum()
-    
-    plt.figure(figsize=(8, 8))
-    plt.imshow(differences.any(axis=-1), cmap='gray')
-    plt.title("Pixels difference between images")
-    
-    plt.text(10, 10, f"Different bits: {bit_differences} (some might have matched before embedding data).", 
-             color='red', fontsize=12, bbox=dict(facecolor='white', alpha=0.7))
-    
-    plt.show()
+    payload = extract_bytes(stego_image_path, a, b, x0, y0)
+    with stage("decode-payload"):
+        return payload_text(payload)
\ No newline at end of file
@@ -0,0 +1,75 @@
+from functools import cached_property
+from bit_utils import iter_flat_tiles
+from profiling import stage
+from raw_carrier import map_pixels
+from PIL import Image
+import numpy as np
+
+def image_pixels(image_path):
+    """Pixels of an image as array; uncompressed images are memory mapped instead of loaded."""
+    image = Image.open(image_path)
+    pixels = map_pixels(image_path, image.mode)
+    return np.asarray(image) if pixels is None else pixels
+
+class ImageComparison:
+    """Differences between cover and stego image, computed on first access (nothing is read before)."""
+
+    def __init__(self, image_path1, image_path2):
+        self.image_path1 = image_path1
+        self.image_path2 = image_path2
+
+    @cached_property
+    def pixels(self):
+        pixels1 = image_pixels(self.image_path1)
+        pixels2 = image_pixels(self.image_path2)
+
+        if pixels1.shape != pixels2.shape:
+            raise ValueError("Images need to be same size.")
+        return pixels1, pixels2
+
+    def difference_tiles(self):
+        """XOR of both images, a few rows at a time (whole difference of large images doesn't fit in memory)."""
+        pixels1, pixels2 = self.pixels
+        for (_, tile1), (_, tile2) in zip(iter_flat_tiles(pixels1), iter_flat_tiles(pixels2)):
+            yield tile1 ^ tile2
+
+    @cached_property
+    def differences(self):
+        pixels1, pixels2 = self.pixels
+        return np.bitwise_xor(pixels1, pixels2)
+
+    @cached_property
+    def bit_differences(self):
+        return sum(int(np.unpackbits(tile).sum()) for tile in self.difference_tiles())
+
+    @cached_property
+    def changed_pixels(self):
+        pixels1, _ = self.pixels
+        channels = pixels1[0, 0].size if pixels1.size else 1
+        changed = np.empty(pixels1.shape[:2], dtype=bool)
+        position = 0
+        for tile in self.difference_tiles():
+            tile_changed = tile.reshape(-1, channels).any(axis=-1)
+            changed.reshape(-1)[position:position + len(tile_changed)] = tile_changed
+            position += len(tile_changed)
+        return changed
+
+    def plot(self):
+        import matplotlib.pyplot as plt
+
+        plt.figure(figsize=(8, 8))
+        plt.imshow(self.changed_pixels, cmap='gray')
+        plt.title("Pixels difference between images")
+
+        plt.text(10, 10, f"Different bits: {self.bit_differences} (some might have matched before embedding data).",
+                 color='red', fontsize=12, bbox=dict(facecolor='white', alpha=0.7))
+
+        plt.show()
+
+def compare_images(image_path1, image_path2, diagnostics=True):
+    """Returns comparison of both images; plots it unless diagnostics are turned off."""
+    comparison = ImageComparison(image_path1, image_path2)
+    if diagnostics:
+        with stage("diagnostics"):
+            comparison.plot()
+    return comparison
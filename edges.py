@@ -1,135 +1,253 @@
-import cv2
+import hashlib
 import numpy as np
-from custom_chaos_implementation import compare_images
+from bit_utils import FRAME_HEADER_SIZE, framed_chunks, iter_chunks, payload_bytes, payload_length, payload_text, read_bit_frame
+from diagnostics import compare_images
+from profiling import stage
+from raw_carrier import can_map_copy, edit_copy, map_pixels
+
+def threshold_steps():
+    """Canny thresholds tried from the highest, same sequence as lowering threshold from 1.0 in 0.01 steps."""
+    thresholds = []
+    threshold = 1.0
+    while threshold > 0:
+        thresholds.append(int(threshold * 255))
+        threshold -= 0.01
+    return thresholds
+
+THRESHOLDS = threshold_steps()
+
+# Canny results by (channel hash, threshold); only a limited number of most recent entries is kept
+EDGE_COUNTS_CACHED = 4096
+EDGE_POSITIONS_CACHED = 4
+_edge_counts = {}
+_edge_positions = {}
+
+def _remember(cache, limit, key, value):
+    if len(cache) >= limit:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+    return value
+
+def channel_hash(channel):
+    return (channel.shape, hashlib.blake2b(np.ascontiguousarray(channel).tobytes(), digest_size=16).hexdigest())
+
+def canny_edges(channel, threshold):
+    import cv2
+
+    return cv2.Canny(np.ascontiguousarray(channel), threshold1=threshold, threshold2=threshold * 2)
+
+def edge_count(channel, threshold, channel_key=None):
+    key = (channel_key or channel_hash(channel), threshold)
+    if key not in _edge_counts:
+        _remember(_edge_counts, EDGE_COUNTS_CACHED, key, int(np.count_nonzero(canny_edges(channel, threshold))))
+    return _edge_counts[key]
+
+def edge_positions(channel, threshold, channel_key=None):
+    """(row, col) positions of edges found for threshold, in raster order.
+
+    Cached by channel_key (see channel_hash) when it's given; a single pass without it skips hashing the channel.
+    """
+    if channel_key is None:
+        return np.argwhere(canny_edges(channel, threshold) != 0)
+    key = (channel_key, threshold)
+    if key not in _edge_positions:
+        positions = np.argwhere(canny_edges(channel, threshold) != 0)
+        positions.flags.writeable = False
+        _remember(_edge_positions, EDGE_POSITIONS_CACHED, key, positions)
+        _remember(_edge_counts, EDGE_COUNTS_CACHED, key, len(positions))
+    return _edge_positions[key]
+
+def find_threshold(channel, min_edges, channel_key=None):
+    """Highest threshold from THRESHOLDS giving at least min_edges edges, or None.
+
+    Number of Canny edges doesn't decrease when threshold is lowered, so binary search is used.
+    """
+    channel_key = channel_key or channel_hash(channel)
+    low, high = 0, len(THRESHOLDS)
+    while low < high:
+        middle = (low + high) // 2
+        if edge_count(channel, THRESHOLDS[middle], channel_key) >= min_edges:
+            high = middle
+        else:
+            low = middle + 1
+    return THRESHOLDS[low] if low < len(THRESHOLDS) else None
+
+# Header hidden in LSBs of the blue component of the first pixels: magic, Canny threshold and message length
+HEADER_MAGIC = b'EDGE'
+HEADER_SIZE = len(HEADER_MAGIC) + 1 + 4
+
+def header_positions(blue):
+    """(rows, cols) of the first pixels in raster order, indexing works in place also for channel views."""
+    return np.divmod(np.arange(min(HEADER_SIZE * 8, blue.size)), blue.shape[1])
+
+def write_header(blue, threshold, message_length):
+    header = HEADER_MAGIC + bytes([threshold]) + message_length.to_bytes(4, 'big')
+    header_bits = np.unpackbits(np.frombuffer(header, dtype=np.uint8))
+    rows, cols = header_positions(blue)
+    blue[rows, cols] = (blue[rows, cols] & 0xFE) | header_bits
+
+def read_header(blue):
+    """Threshold and hidden data length (bytes, with frame header) or None if image has no header."""
+    header = np.packbits(blue[header_positions(blue)] & 1).tobytes()
+    if len(header) < HEADER_SIZE or not header.startswith(HEADER_MAGIC):
+        return None
+    return header[len(HEADER_MAGIC)], int.from_bytes(header[len(HEADER_MAGIC) + 1:], 'big')
+
+def channel_views(image, rgb=False):
+    """Image with its blue, green and red channels (views, changes go to the image); image is BGR as read by
+    OpenCV, or RGB (mapped images)."""
+    blue, green, red = (2, 1, 0) if rgb else (0, 1, 2)
+    return image, image[:, :, blue], image[:, :, green], image[:, :, red]
+
+def load_channels(image_path):
+    """Image with its blue, green and red channels (see channel_views), None if it can't be read.
+
+    Uncompressed images (PPM, BMP, TIFF) are memory mapped (read only) instead of loaded.
+    """
+    import cv2
+
+    pixels = map_pixels(image_path)
+    if pixels is not None:
+        return channel_views(pixels, rgb=True)
+
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+    return channel_views(image)
+
+def embed_message(image_path, secret_message, output_path, edge_positions_file=None, diagnostics=True):
+    import cv2
 
-def embed_message(image_path, secret_message, output_path, edge_positions_file):
     try:
+        # Message can be text, bytes or binary stream; threshold depends on its length, so streams which
+        # can't tell it (pipes) are read whole, others are read piece by piece while being hidden
+        length = payload_length(secret_message)
+        if length is None:
+            secret_message = payload_bytes(secret_message)
+            length = len(secret_message)
         capacity = calculate_capacity_return_number(image_path)
 
-        if (capacity < len(secret_message)):
-            raise Exception(f"Couldn't embed {len(secret_message)} chars in the image. Max capacity is: {capacity}.")
+        if (capacity < length):
+            raise Exception(f"Couldn't embed {length} bytes in the image. Max capacity is: {capacity}.")
 
-        # Add end of message character
-        secret_message += '\0' 
+        def embed_channels(image, blue, green, red):
+            # Step 1: RGB components - green and blue are changed in place, red is only read (so a copy is fine
+            # and spares copying it for every Canny pass)
+            with stage("load"):
+                red = np.ascontiguousarray(red)
 
-        # Step 1: Read the color image
-        image = cv2.imread(image_path)
-        if image is None:
-            raise FileNotFoundError("Image not found at the specified path.")
+            # Step 2: Find highest threshold giving required number of edges
+            message_length = (FRAME_HEADER_SIZE + length) * 8
+            with stage("locate-carriers"):
+                red_key = channel_hash(red)
+                threshold = find_threshold(red, message_length, red_key)
+                if threshold is None:
+                    raise ValueError("Not enough edges to hide the message.")
 
-        # Step 2: Split into RGB components
-        blue, green, red = cv2.split(image)
-
-        # Step 3: Convert secret message to binary
-        message_bits = ''.join([f'{ord(c):08b}' for c in secret_message])
-        message_length = len(message_bits)
-        
-        # Step 4: Dynamically adjust threshold to find required number of edges; start from highest value
-        threshold = 1.0 
-        edges = None
-        edge_positions = []
-
-        # Gradually decrease threshold until required number of edges is found
-        while threshold > 0:
-            current_threshold = int(threshold * 255)
-            edges = cv2.Canny(red, threshold1=current_threshold, threshold2=current_threshold * 2)
-            edge_positions = np.column_stack(np.where(edges != 0)) 
-            
-            # Check whether enough edges to hide message
-            if len(edge_positions) >= message_length:
-                break
-            
-            threshold -= 0.01
+                edges = edge_positions(red, threshold, red_key)
+
+            # Step 3: Store threshold in the image; number of edge positions is still saved for older versions
+            with stage("embed"):
+                write_header(blue, threshold, message_length // 8)
+                if edge_positions_file:
+                    with open(edge_positions_file, 'w') as f:
+                        f.write(str(len(edges)))
+
+            # Step 4: Embed the bits of the secret message in the LSB of the green component at edge positions, chunk by chunk
+            for offset, chunk in framed_chunks(secret_message, length):
+                with stage("encode-payload"):
+                    message_bits = np.unpackbits(chunk)
 
-        edge_count = len(edge_positions)
-        
-        # Save number of edge positions to the specified file to be able to properly extract
-        with open(edge_positions_file, 'w') as f:
-            f.write(str(edge_count))
+                with stage("embed"):
+                    rows, cols = edges[offset * 8:offset * 8 + len(message_bits)].T
+                    green[rows, cols] = (green[rows, cols] & 0xFE) | message_bits
 
-        # Step 5: Embed the bits of the secret message in the LSB of the green component at edge positions
-        for i, bit in enumerate(message_bits):
-            row, col = edge_positions[i]
-            green[row, col] = (green[row, col] & 0xFE) | int(bit)
+        # Step 5: Read the color image and embed; uncompressed images saved in the same format aren't loaded, their
+        # mapped copy is embedded in place and becomes the stego image if embedding succeeds (see raw_carrier.edit_copy)
+        if can_map_copy(image_path, output_path):
+            edit_copy(lambda pixels: embed_channels(*channel_views(pixels, rgb=True)), image_path, output_path)
+        else:
+            with stage("load"):
+                image = cv2.imread(image_path)
+                if image is None:
+                    raise FileNotFoundError("Image not found at the specified path.")
+            embed_channels(*channel_views(image))
 
-        # Step 6: Merge the components (Blue, Green, Red) into the stego image
-        stego_image = cv2.merge((blue, green, red))
-        
-        cv2.imwrite(output_path, stego_image)
-        compare_images(image_path, output_path)
+            # Step 6: Components were changed in place, save the stego image
+            with stage("encode-output"):
+                cv2.imwrite(output_path, image)
+        return compare_images(image_path, output_path, diagnostics)
 
     except Exception as e:
         raise Exception(f"Error during embeding: {e}")
 
-def extract_message(stego_image_path, edge_positions_file):
+def extract_bytes(stego_image_path, edge_positions_file=None):
     try:
-        # Step 1: Read the edge positions count from the file
-        with open(edge_positions_file, 'r') as f:
-            edge_positions_count = int(f.read().strip())
-        
-        # Step 2: Read the stego image and split into RGB components
-        stego_image = cv2.imread(stego_image_path)
-        if stego_image is None:
-            raise FileNotFoundError("Stego image not found at the specified path.")
-
-        blue, green, red = cv2.split(stego_image)
-
-        # Step 3: Start from the highest threshold and decrease until proper number of edges achieved
-        threshold = 1.0
-        extracted_bits = []
-
-        while threshold > 0:
-            current_threshold = int(threshold * 255)
-            edges = cv2.Canny(red, threshold1=current_threshold, threshold2=current_threshold * 2)
-            edge_positions = np.column_stack(np.where(edges != 0))
-            
-            # Check if proper number of edges achieved
-            if len(edge_positions) == edge_positions_count:
-                break
-            
-            threshold -= 0.01
-            if threshold <= 0:
-                raise ValueError("Cannot match edge positions with the required count.")
-
-        # Step 4: Extract bits from the LSB of the green component at edge positions
-        for i in range(edge_positions_count):
-            row, col = edge_positions[i]
-            bit = green[row, col] & 0x01
-            extracted_bits.append(str(bit))
-            
-            # Check for end of message
-            if len(extracted_bits) >= 8:
-                last_byte = ''.join(extracted_bits[-8:])
-                if last_byte == '00000000':
-                    break
-
-        # Step 5: Combine bits into the secret message
-        message_chars = [chr(int(''.join(extracted_bits[i:i + 8]), 2)) for i in range(0, len(extracted_bits), 8)]
-        secret_message = ''.join(message_chars).rstrip('\0')  # Remove newline character
-        return secret_message
+        # Step 1: Read the stego image and take its RGB components
+        with stage("load"):
+            channels = load_channels(stego_image_path)
+            if channels is None:
+                raise FileNotFoundError("Stego image not found at the specified path.")
+
+            _, blue, green, red = channels
+            red = np.ascontiguousarray(red)
+
+        with stage("locate-carriers"):
+            # Step 2: Read threshold from the image header, single Canny pass
+            header = read_header(blue)
+            if header is not None:
+                threshold, message_length = header
+                edges = edge_positions(red, threshold)[:message_length * 8]
+
+            # Step 3: Images without header - find highest threshold giving the number of edges from the file
+            else:
+                if not edge_positions_file:
+                    raise ValueError("Image has no edges header, edge positions file is required.")
+
+                with open(edge_positions_file, 'r') as f:
+                    edge_positions_count = int(f.read().strip())
+
+                red_key = channel_hash(red)
+                threshold = find_threshold(red, edge_positions_count, red_key)
+                if threshold is None or edge_count(red, threshold, red_key) != edge_positions_count:
+                    raise ValueError("Cannot match edge positions with the required count.")
+
+                edges = edge_positions(red, threshold, red_key)
+
+        # Step 4: Extract bits from the LSB of the green component at edge positions, until end of message
+        with stage("extract"):
+            bits = (green[rows, cols] & 0x01 for rows, cols in (chunk.T for chunk in iter_chunks(edges)))
+
+            # Step 5: Combine bits into the secret message
+            return read_bit_frame(bits)
     
     except Exception as e:
         raise Exception(f"Error during extracting: {e}")
 
+def extract_message(stego_image_path, edge_positions_file=None):
+    payload = extract_bytes(stego_image_path, edge_positions_file)
+    with stage("decode-payload"):
+        return payload_text(payload)
+
 def calculate_capacity_return_number(image_path):
     try:   
         # Step 1: Read the color image
-        image = cv2.imread(image_path)
-        if image is None:
+        channels = load_channels(image_path)
+        if channels is None:
             raise FileNotFoundError("Image not found at the specified path.")
 
-        # Step 2: Split into RGB components (using only the green channel as used for hiding)
-        blue, green, red = cv2.split(image)
+        # Step 2: Take RGB components (using only the green channel as used for hiding)
+        _, blue, green, red = channels
 
         # Step 3: Use min threshold as it matches to the max capacity
         min_threshold = 0.01
         scaled_threshold = int(min_threshold * 255)
 
-        edges = cv2.Canny(green, threshold1=scaled_threshold, threshold2=2 * scaled_threshold)
+        edges = canny_edges(green, scaled_threshold)
             
         # Step 4: Calculate the number of edge positions
         edge_positions = np.column_stack(np.where(edges != 0))
-        capacity = len(edge_positions)//8 - 1 # Each edge pixel can hold 1 bit; -1 byte because of end message indicator
+        capacity = len(edge_positions)//8 - FRAME_HEADER_SIZE # Each edge pixel can hold 1 bit; frame header takes a few bytes
 
         return capacity
     
@@ -140,4 +258,4 @@ def calculate_capacity_return_number(image_path):
 def calculate_capacity(image_path):
     capacity = calculate_capacity_return_number(image_path)
 
-    return f"Maximum capacity for embedding: {capacity} chars (it's for min threshold=0.01)"
\ No newline at end of file
+    return f"Maximum capacity for embedding: {capacity} bytes (it's for min threshold=0.01)"
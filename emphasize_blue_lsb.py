@@ -1,101 +1,70 @@
-from custom_chaos_implementation import compare_images
+from diagnostics import compare_images
+from bit_utils import FRAME_HEADER_SIZE, check_capacity, edit_tiles, framed_chunks, payload_text, read_frame, run_tiles
+from profiling import stage
+from raw_carrier import edit_rgb_carrier, open_rgb_carrier
 from PIL import Image
 
 def calculate_capacity_return_number(image_path):
     try:
         image = Image.open(image_path)
         width, height = image.size
-        capacity = (((width*height*8)//8)-1)
+        capacity = (((width*height*8)//8)-FRAME_HEADER_SIZE)
         return capacity
     except Exception as e:
         raise Exception(f"Error during calculating capacity: {e}")
 
 def calculate_capacity(image_path):
     capacity = calculate_capacity_return_number(image_path)
-    return f"Maximum message size is {capacity} chars."
+    return f"Maximum message size is {capacity} bytes."
 
-def embed_message(image_path, secret_message, output_path):
+def embed_message(image_path, secret_message, output_path, diagnostics=True, workers=1):
     try:
+        # Step 1: Capacity is checked before anything is written (streams are checked while being read)
         capacity = calculate_capacity_return_number(image_path)
-
-        if (capacity < len(secret_message)):
-            raise Exception(f"Couldn't embed {len(secret_message)} chars in the image. Max capacity is: {capacity}.")
-
-        # Step 1: Convert message to bits
-        message_bits = ''.join(format(ord(char), '08b') for char in secret_message + '\0')
-
-        # Step 2: Load image
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
-
-        bit_index = 0
-
-        # Step 3: LSB 2-2-4
-        for y in range(height):
-            for x in range(width):
-                if bit_index >= len(message_bits):
-                    break
-                
-                r, g, b = pixels[x, y]
-
-                # Change 2 LSB for R
-                if bit_index + 2 <= len(message_bits):
-                    r = (r & ~3) | int(message_bits[bit_index:bit_index + 2], 2)
-                    bit_index += 2
-
-                # Change 2 LSB for G
-                if bit_index + 2 <= len(message_bits):
-                    g = (g & ~3) | int(message_bits[bit_index:bit_index + 2], 2)
-                    bit_index += 2
-
-                # Change 4 LSB for B
-                if bit_index + 4 <= len(message_bits):
-                    b = (b & ~15) | int(message_bits[bit_index:bit_index + 4], 2)
-                    bit_index += 4
-
-                pixels[x, y] = (r, g, b)
-
-        image.save(output_path)
-
-        compare_images(image_path, output_path)
+        check_capacity(secret_message, capacity)
+
+        # Step 2: Message (text, bytes or binary stream read piece by piece) is hidden chunk by chunk,
+        # each byte goes to one pixel
+        def embed_payload(pixels):
+            for offset, message_bytes in framed_chunks(secret_message, capacity):
+                # Step 3: LSB 2-2-4 - 2 MSB of a byte go to R, next 2 to G and 4 LSB to B; tiles are independent,
+                # with more workers they are embedded concurrently
+                def embed_tile(index, values):
+                    carriers = values.reshape(-1, 3)
+                    tile_bytes = message_bytes[index // 3:index // 3 + len(carriers)]
+                    carriers[:, 0] = (carriers[:, 0] & 0xFC) | (tile_bytes >> 6)
+                    carriers[:, 1] = (carriers[:, 1] & 0xFC) | ((tile_bytes >> 4) & 3)
+                    carriers[:, 2] = (carriers[:, 2] & 0xF0) | (tile_bytes & 15)
+
+                with stage("embed"):
+                    edit_tiles(embed_tile, pixels, offset * 3, (offset + len(message_bytes)) * 3, workers)
+
+        # Step 4: Load the image, embed and save it (uncompressed images are embedded in place, see raw_carrier.edit_rgb_carrier)
+        edit_rgb_carrier(embed_payload, image_path, output_path)
+        return compare_images(image_path, output_path, diagnostics)
 
     except Exception as e:
         raise Exception(f"Error during embeding: {e}")
 
-def extract_message(image_path):
+def extract_bytes(image_path, workers=1):
     try:
-        # Step 1: Load image
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
-
-        binary_message = ''
-
-        # Step 2: Iterate through pixels LSB 2-2-4
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-
-                # Take 2 LSB from R
-                binary_message += format(r & 3, '02b')
-                # Take 2 LSB from G
-                binary_message += format(g & 3, '02b')
-                # Take 4 LSB from B
-                binary_message += format(b & 15, '04b')
-
-        # Step 3: Convert Bits to ASCII
-        decoded_message = ''
-        for i in range(0, len(binary_message), 8):
-            byte = binary_message[i:i + 8]  
-            if len(byte) == 8:
-                decoded_message += chr(int(byte, 2))
-
-                # Check for end of message
-                if decoded_message[-1:] == '\0': 
-                    return decoded_message[:-1]
-
-        return decoded_message
+        # Step 1: Load image (uncompressed images are memory mapped)
+        with stage("load"):
+            pixels = open_rgb_carrier(image_path)
+
+        # Step 2: Take 2 LSB from R, 2 LSB from G and 4 LSB from B - one byte per pixel, until end of message
+        def extract_tile(index, values):
+            chunk = values.reshape(-1, 3)
+            return ((chunk[:, 0] & 3) << 6) | ((chunk[:, 1] & 3) << 4) | (chunk[:, 2] & 15)
+
+        with stage("extract"):
+            message_bytes = run_tiles(extract_tile, pixels, workers=workers)
+            return read_frame(message_bytes)
     
     except Exception as e:
-        raise Exception(f"Error during extracting: {e}")
\ No newline at end of file
+        raise Exception(f"Error during extracting: {e}")
+
+def extract_message(image_path, workers=1):
+    payload = extract_bytes(image_path, workers)
+    with stage("decode-payload"):
+        return payload_text(payload)
\ No newline at end of file
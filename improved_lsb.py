@@ -1,58 +1,49 @@
-from custom_chaos_implementation import compare_images
+from diagnostics import compare_images
+from bit_utils import CHUNK_SIZE, FRAME_HEADER_SIZE, frame_payload, iter_chunks, payload_bytes, payload_text, read_bit_frame
+from profiling import stage
 from PIL import Image
+import numpy as np
+import base64
 import os
-from cryptography.fernet import Fernet
 import json
 
+# First byte of every Fernet token (version), base64 text of a token starts with 'g' instead
+FERNET_VERSION = b'\x80'
+
 def calculate_capacity_return_number(image_path):
     try:
         image = Image.open(image_path)
         width, height = image.size
-        capacity = (((width*height*3)//8)-1)
+        capacity = (((width*height*3)//8)-FRAME_HEADER_SIZE)
         return capacity
     except Exception as e:
         raise Exception(f"Error during calculating capacity: {e}")
 
 def calculate_capacity(image_path):
     capacity = calculate_capacity_return_number(image_path)    
-    return f"Maximum message size is less than {capacity} chars\n(doesn't take encoding into consideration, actual capacity is lower)."
-
-# Set LSB bit
-def set_lsb(value, bit):
-    return (value & ~1) | bit
+    return f"Maximum message size is less than {capacity} bytes\n(doesn't take encryption into consideration, actual capacity is lower)."
 
 # Generate key
 def generate_key():
+    from cryptography.fernet import Fernet
     return Fernet.generate_key()
 
-# Encrypt message
+# Encrypt message (bytes), returns raw Fernet token (without base64 encoding)
 def encrypt_message(message, secret_key):
+    from cryptography.fernet import Fernet
     fernet = Fernet(secret_key)
-    encrypted_message = fernet.encrypt(message.encode())
+    encrypted_message = base64.urlsafe_b64decode(fernet.encrypt(message))
     return encrypted_message
 
-# Decrypt message
+# Decrypt raw Fernet token to bytes; images from older versions hold base64 text of the token
 def decrypt_message(encrypted_message, secret_key):
+    from cryptography.fernet import Fernet
     fernet = Fernet(secret_key)
-    decrypted_message = fernet.decrypt(encrypted_message).decode()
+    if encrypted_message.startswith(FERNET_VERSION):
+        encrypted_message = base64.urlsafe_b64encode(encrypted_message)
+    decrypted_message = fernet.decrypt(encrypted_message)
     return decrypted_message
 
-# Convert text to bits
-def text_to_bits(text):
-    bits = ''.join(format(ord(char), '08b') for char in text)
-    return bits
-
-# Convert bits to text
-def bits_to_text(bits):
-    chars = [chr(int(bits[i:i + 8], 2)) for i in range(0, len(bits), 8)]
-    return ''.join(chars)
-
-# Expand key to fit the message's length
-def extend_secret_key(secret_key, target_length):
-    secret_key_bits = text_to_bits(secret_key)
-    extended_key = (secret_key_bits * ((target_length // len(secret_key_bits)) + 1))[:target_length]
-    return extended_key
-
 # Save key to a file
 def save_key(secret_key, key_file_path):
     metadata = {
@@ -71,96 +62,96 @@ def load_key(key_file_path):
         secret_key = metadata['secret_key'].encode()
         return secret_key
 
-def embed_message(image_path, message, output_path, key_file_path):
+# Key bits repeated cyclically to the given length
+def key_stream(secret_key, length):
+    secret_key_bits = np.unpackbits(np.frombuffer(secret_key, dtype=np.uint8))
+    return np.resize(secret_key_bits, length)
+
+def embed_message(image_path, message, output_path, key_file_path, diagnostics=True):
     try:
+        # Message can be text, bytes or file-like object
+        payload = payload_bytes(message)
         capacity = calculate_capacity_return_number(image_path)
 
-        if (capacity < len(message)):
-            raise Exception(f"Couldn't embed {len(message)} chars in the image. Max capacity is: {capacity}.")
+        if (capacity < len(payload)):
+            raise Exception(f"Couldn't embed {len(payload)} bytes in the image. Max capacity is: {capacity}.")
         
         # Step 1: Generate key
         secret_key = generate_key()
         
         # Step 2: Load image
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
+        with stage("load"):
+            image = Image.open(image_path)
+            if image.mode != 'RGB':
+                raise ValueError(f"Expected RGB image, got {image.mode}.")
+            pixels = np.array(image).reshape(-1, 3)
 
         # Step 3: Encrypt message
-        encrypted_message = encrypt_message(message, secret_key)
-
-        message_bits = text_to_bits(encrypted_message.decode() + '\0')
+        with stage("encode-payload"):
+            encrypted_message = encrypt_message(payload, secret_key)
 
-        secret_key_bits = extend_secret_key(secret_key.decode(), len(message_bits))
+            message_bits = np.unpackbits(frame_payload(encrypted_message))
+            message_length = len(message_bits)
 
-        message_index = 0
-        message_length = len(message_bits)
+        if message_length > len(pixels):
+            raise Exception(f"Encrypted message needs {message_length} pixels, image has only {len(pixels)}.")
 
         # Step 4: LSB
-        for y in range(height):
-            for x in range(width):
-                if message_index >= message_length:
-                    break
-
-                r, g, b = pixels[x, y]
-
-                # XOR key bit with Red
-                xor_value = int(secret_key_bits[message_index]) ^ (r & 1)
+        with stage("locate-carriers"):
+            secret_key_bits = key_stream(secret_key, message_length)
+            carriers = pixels[:message_length]
 
-                # If XOR value 1, then LSB with B
-                if xor_value == 1:
-                    b = set_lsb(b, int(message_bits[message_index]))
-                # If XOR value 0, then LSB with G
-                else:
-                    g = set_lsb(g, int(message_bits[message_index]))
+            # XOR key bit with Red; if XOR value 1, then LSB with B, otherwise LSB with G
+            use_blue = (secret_key_bits ^ (carriers[:, 0] & 1)).astype(bool)
+            channels = np.where(use_blue, 2, 1)
+            rows = np.arange(message_length)
 
-                pixels[x, y] = (r, g, b)
+        with stage("embed"):
+            carriers[rows, channels] = (carriers[rows, channels] & 0xFE) | message_bits
 
-                message_index += 1
+        with stage("encode-output"):
+            image.frombytes(pixels.tobytes())
+            image.save(output_path)
 
-        image.save(output_path)
+            # Step 5: Save key to a file
+            save_key(secret_key, key_file_path)
 
-        # Step 4: Save key to a file
-        save_key(secret_key, key_file_path)
-
-        compare_images(image_path, output_path)
+        return compare_images(image_path, output_path, diagnostics)
 
     except Exception as e:
         raise Exception(f"Error during embeding: {e}")
 
-def extract_message(stego_image_path, key_file_path):
+def extract_bytes(stego_image_path, key_file_path):
     try:
         # Step 1: Load image
-        image = Image.open(stego_image_path)
-        pixels = image.load()
-        width, height = image.size
-
-        # Step 2: Load key
-        secret_key = load_key(key_file_path)
-
-        binary_message = []
-
-        # Step 3: LSB
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-
-                xor_value = int(extend_secret_key(secret_key.decode(), len(binary_message) + 1)[len(binary_message)]) ^ (r & 1)
-
-                # If XOR value 1, then take LSB from B
-                if xor_value == 1:
-                    binary_message.append(str(b & 1))
-                # If XOR value 0, then take LSB from G
-                else:
-                    binary_message.append(str(g & 1))
-
-                # Check for end of message
-                if len(binary_message) % 8 == 0:
-                    extracted_text = bits_to_text(''.join(binary_message))
-                    if '\0' in extracted_text:
-                        extracted_text = extracted_text.split('\0')[0]
-                        decrypted_message = decrypt_message(extracted_text.encode(), secret_key)
-                        return decrypted_message
+        with stage("load"):
+            image = Image.open(stego_image_path)
+            if image.mode != 'RGB':
+                raise ValueError(f"Expected RGB image, got {image.mode}.")
+            pixels = np.asarray(image).reshape(-1, 3)
+
+        # Step 2: Load key and repeat it once for a whole chunk (chunk length is a multiple of key length)
+        with stage("locate-carriers"):
+            secret_key = load_key(key_file_path)
+            key_length = len(secret_key) * 8
+            chunk_size = max(CHUNK_SIZE // key_length, 1) * key_length
+            secret_key_bits = key_stream(secret_key, chunk_size)
+
+        # Step 3: LSB - if XOR of key bit and Red LSB is 1, then take LSB from B, otherwise from G
+        def message_bits():
+            for chunk in iter_chunks(pixels, chunk_size):
+                use_blue = (secret_key_bits[:len(chunk)] ^ (chunk[:, 0] & 1)).astype(bool)
+                yield np.where(use_blue, chunk[:, 2], chunk[:, 1]) & 1
+
+        # Step 4: Convert bits to bytes, stops at end of message
+        with stage("extract"):
+            extracted_message = read_bit_frame(message_bits())
+        with stage("decode-payload"):
+            decrypted_message = decrypt_message(extracted_message, secret_key)
+        return decrypted_message
 
     except Exception as e:
-        raise Exception(f"Error during extracting: {e}")
\ No newline at end of file
+        raise Exception(f"Error during extracting: {e}")
+
+def extract_message(stego_image_path, key_file_path):
+    return payload_text(extract_bytes(stego_image_path, key_file_path))
\ No newline at end of file
@@ -0,0 +1,83 @@
+import importlib
+import os
+
+# Method modules by method name, imported on first use so that startup doesn't pay for all of them
+METHOD_MODULES = {
+    "rdh": "rdh_grayscale",
+    "standard_lsb": "standard_lsb",
+    "improved_lsb": "improved_lsb",
+    "emphasize_blue_lsb": "emphasize_blue_lsb",
+    "msb": "msb_using_bit_differencing",
+    "edges": "edges",
+    "chaos": "custom_chaos_implementation",
+}
+
+# Methods saving an extra file needed for extraction (metadata, key, edge positions); optional for edges.
+# Batch extraction pairs images with sidecars by name: <image name without extension><sidecar extension>,
+# sidecars with extensions used by older versions (RDH metadata was JSON only) are found as well
+SIDECAR_EXTENSIONS = {"rdh": ".rdh", "improved_lsb": ".key", "edges": ".txt"}
+OLDER_SIDECAR_EXTENSIONS = {"rdh": ".json"}
+SIDECAR_METHODS = set(SIDECAR_EXTENSIONS)
+
+# Methods which can embed and extract on several threads: carrier of bit k depends only on k (row bands of
+# the image are processed concurrently) or, for RDH, on the bits hidden in previous blocks (blocks are)
+THREADED_METHODS = {"standard_lsb", "emphasize_blue_lsb", "msb", "rdh"}
+
+# Methods restoring the cover image exactly on extraction
+REVERSIBLE_METHODS = {"rdh"}
+
+def load_method(method):
+    if method not in METHOD_MODULES:
+        raise ValueError(f"Unknown method '{method}', available methods: {', '.join(METHOD_MODULES)}.")
+    return importlib.import_module(METHOD_MODULES[method])
+
+def thread_options(method, workers):
+    """Keyword arguments passing workers to the method (only methods from THREADED_METHODS take them)."""
+    if workers == 1:
+        return {}
+    if method not in THREADED_METHODS:
+        raise ValueError(f"Method '{method}' can't run on several threads, available for: {', '.join(sorted(THREADED_METHODS))}.")
+    return {"workers": workers}
+
+def embed(method, image_path, message, output_path, sidecar_path=None, diagnostics=True, workers=1):
+    module = load_method(method)
+    options = thread_options(method, workers)
+    if method in SIDECAR_METHODS:
+        if not sidecar_path and method != "edges":
+            raise ValueError(f"Method '{method}' requires a sidecar file path.")
+        return module.embed_message(image_path, message, output_path, sidecar_path, diagnostics=diagnostics, **options)
+    return module.embed_message(image_path, message, output_path, diagnostics=diagnostics, **options)
+
+def embed_file(method, image_path, payload, output_path, sidecar_path=None, diagnostics=True, workers=1):
+    """Hides a payload given by file path or as binary stream; it's read in chunks while being hidden,
+    except for methods which need it whole (improved_lsb encrypts it, rdh scrambles it at once)."""
+    if isinstance(payload, (str, os.PathLike)):
+        with open(payload, "rb") as file:
+            return embed(method, image_path, file, output_path, sidecar_path, diagnostics, workers)
+    return embed(method, image_path, payload, output_path, sidecar_path, diagnostics, workers)
+
+def extract(method, image_path, sidecar_path=None, as_bytes=False, workers=1):
+    """Extracts the message (text, or bytes if as_bytes) only: no plots and no files written (recovered RDH cover is dropped)."""
+    module = load_method(method)
+    options = thread_options(method, workers)
+    if method in SIDECAR_METHODS and not sidecar_path and method != "edges":
+        raise ValueError(f"Method '{method}' requires a sidecar file path.")
+    if method == "rdh":
+        recover = module.recover_bytes if as_bytes else module.recover_message
+        return recover(image_path, sidecar_path, diagnostics=False, **options)[0]
+    extract_function = module.extract_bytes if as_bytes else module.extract_message
+    if method in SIDECAR_METHODS:
+        return extract_function(image_path, sidecar_path)
+    return extract_function(image_path, **options)
+
+def recover(method, image_path, sidecar_path, as_bytes=False, workers=1, output_path=None, encoder_params=None):
+    """Extracts the message and restores the cover of a reversible method; returns (message, cover pixels).
+    Cover is written to output_path only if it's given, encoder_params are OpenCV imwrite flags and values."""
+    if method not in REVERSIBLE_METHODS:
+        raise ValueError(f"Method '{method}' doesn't restore the cover image, available for: {', '.join(sorted(REVERSIBLE_METHODS))}.")
+    if not sidecar_path:
+        raise ValueError(f"Method '{method}' requires a sidecar file path.")
+    module = load_method(method)
+    recover_function = module.recover_bytes if as_bytes else module.recover_message
+    return recover_function(image_path, sidecar_path, diagnostics=False, output_path=output_path,
+                            encoder_params=encoder_params, **thread_options(method, workers))
@@ -1,87 +1,70 @@
-from custom_chaos_implementation import compare_images
+from diagnostics import compare_images
+from bit_utils import FRAME_HEADER_SIZE, check_capacity, edit_tiles, framed_chunks, payload_text, read_bit_frame, run_tiles
+from profiling import stage
+from raw_carrier import edit_rgb_carrier, open_rgb_carrier
 from PIL import Image
+import numpy as np
 
-def calculate_capacity(image_path):
+def calculate_capacity_return_number(image_path):
     try:
         image = Image.open(image_path)
-        pixels = image.load()
         width, height = image.size
-        return f"Maximum message size is {((width*height)//8)-1} chars."
+        return ((width*height)//8)-FRAME_HEADER_SIZE
     
     except Exception as e:
         raise Exception(f"Error during calculating capacity: {e}")
 
-def embed_message(image_path, message, output_path):
+def calculate_capacity(image_path):
+    capacity = calculate_capacity_return_number(image_path)
+    return f"Maximum message size is {capacity} bytes."
+
+def embed_message(image_path, message, output_path, diagnostics=True, workers=1):
     try:
-        # Convert message to bits
-        message_bits = ''.join(format(ord(char), '08b') for char in message +'\0' )
-        
-        # Load image
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
-        
-        bit_index = 0  # Message bit index
-        
-        for y in range(height):
-            for x in range(width):
-                if bit_index >= len(message_bits):
-                    break
-                
-                r, g, b = pixels[x, y]
-                
-                # Read 5th and 6th bit
-                bit_5 = (r >> 4) & 1
-                bit_6 = (r >> 5) & 1
-                
-                if abs(bit_6 - bit_5) != int(message_bits[bit_index]):
-                    if bit_5 == 0:
-                        r = r | (1<<4) # Set 5th bit
-                    else:
-                        r = r & ~ (1<<4) # Clear 5th bit
-                
-                pixels[x, y] = (r, g, b)
+        # Capacity is checked before anything is written (streams are checked while being read)
+        capacity = calculate_capacity_return_number(image_path)
+        check_capacity(message, capacity)
+
+        # Message (text, bytes or binary stream read piece by piece) is hidden chunk by chunk
+        def embed_payload(pixels):
+            for offset, chunk in framed_chunks(message, capacity):
+                with stage("encode-payload"):
+                    message_bits = np.unpackbits(chunk)
 
-                r, g, b = pixels[x, y]
-                bit_index += 1
-        
-        image.save(output_path)
-        compare_images(image_path, output_path)
+                # Difference of 6th and 5th bit has to match message bit, otherwise 5th bit is flipped
+                # (tiles are independent, with more workers they are embedded concurrently)
+                def embed_tile(index, values):
+                    red = values[::3]
+                    bits_differ = ((red >> 4) ^ (red >> 5)) & 1
+                    red ^= (bits_differ ^ message_bits[index // 3:index // 3 + len(red)]) << 4
+
+                with stage("embed"):
+                    edit_tiles(embed_tile, pixels, offset * 24, (offset * 8 + len(message_bits)) * 3, workers)
+
+        # Load the image, embed and save it (uncompressed images are embedded in place, see raw_carrier.edit_rgb_carrier)
+        edit_rgb_carrier(embed_payload, image_path, output_path)
+        return compare_images(image_path, output_path, diagnostics)
 
     except Exception as e:
         raise Exception(f"Error during embeding: {e}")
  
-def extract_message(stego_image_path):
+def extract_bytes(stego_image_path, workers=1):
     try:
-        image = Image.open(stego_image_path)
-        pixels = image.load()
-        width, height = image.size
+        with stage("load"):
+            pixels = open_rgb_carrier(stego_image_path)
 
-        message_bits = []  # List for message bits
+        # Extract message bits (5th bit differs from 6th bit -> '1') from Red, tile by tile until end of message
+        def extract_tile(index, values):
+            red = values[::3]
+            return ((red >> 4) ^ (red >> 5)) & 1
 
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-                bit_5 = (r >> 4) & 1
-                bit_6 = (r >> 5) & 1
-                # Extract message bit
-                if bit_6 == bit_5:
-                    message_bits.append(0)
-                else:
-                    message_bits.append(1)
-
-        # Bits to ASCII conversion
-        message = ''
-        for i in range(0, len(message_bits), 8):
-            byte = message_bits[i:i+8]  # Get next 8 bits
-            if len(byte) == 8:
-                # Convert bits to one ASCII char
-                char = chr(int(''.join(map(str, byte)), 2))
-                if char == '\0':
-                    break
-                message += char
-
-        return message
+        with stage("extract"):
+            message_bits = run_tiles(extract_tile, pixels, workers=workers)
+            return read_bit_frame(message_bits)
     
     except Exception as e:
         raise Exception(f"Error during extracting: {e}")
+
+def extract_message(stego_image_path, workers=1):
+    payload = extract_bytes(stego_image_path, workers)
+    with stage("decode-payload"):
+        return payload_text(payload)
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""Opt-in per-stage profiling of embedding and extraction.
+
+Methods mark their stages with `with stage("load"):`, which does nothing unless a profile is active:
+
+    with profile(cprofile_path="embed.prof") as result:
+        standard_lsb.embed_message("cover.png", "message", "stego.png", diagnostics=False)
+    print(result)
+
+Stages of embedding are load, encode-payload, locate-carriers, embed, encode-output and diagnostics;
+extraction has load, locate-carriers, extract and decode-payload. Methods record only the stages they
+have, a stage run several times (e.g. RDH retrying block sizes) is recorded every time.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+import time
+import tracemalloc
+
+# Allocated bytes are the net change of memory traced by tracemalloc, peak is the highest point during
+# the stage above its start (NumPy buffers are traced, memory allocated inside Pillow or OpenCV isn't)
+Stage = namedtuple("Stage", ["name", "seconds", "allocated_bytes", "peak_bytes"])
+
+_current_profile = ContextVar("current_profile", default=None)
+
+class Profile:
+    """Stages recorded while the profile was active, in order of completion."""
+
+    def __init__(self, memory=True, cprofile_path=None):
+        self.memory = memory
+        self.cprofile_path = cprofile_path
+        self.stages = []
+        self.total_seconds = None
+
+    def totals(self):
+        """Stage name -> Stage with summed time and allocations and the highest peak, in order of first run."""
+        totals = {}
+        for stage in self.stages:
+            if stage.name not in totals:
+                totals[stage.name] = stage
+                continue
+            total = totals[stage.name]
+            totals[stage.name] = Stage(
+                stage.name,
+                total.seconds + stage.seconds,
+                None if stage.allocated_bytes is None else total.allocated_bytes + stage.allocated_bytes,
+                None if stage.peak_bytes is None else max(total.peak_bytes, stage.peak_bytes),
+            )
+        return totals
+
+    def as_dict(self):
+        return {
+            "total_seconds": self.total_seconds,
+            "stages": [stage._asdict() for stage in self.stages],
+        }
+
+    def __str__(self):
+        lines = [f"{'stage':<18}{'time [ms]':>12}{'allocated [MB]':>16}{'peak [MB]':>12}"]
+        for stage in self.totals().values():
+            line = f"{stage.name:<18}{stage.seconds * 1000:>12.2f}"
+            if stage.allocated_bytes is not None:
+                line += f"{stage.allocated_bytes / 2**20:>16.2f}{stage.peak_bytes / 2**20:>12.2f}"
+            lines.append(line)
+        if self.total_seconds is not None:
+            lines.append(f"{'total':<18}{self.total_seconds * 1000:>12.2f}")
+        return "\n".join(lines)
+
+@contextmanager
+def profile(memory=True, cprofile_path=None):
+    """Records stages run inside the block; cProfile statistics are dumped to cprofile_path, if given."""
+    result = Profile(memory, cprofile_path)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if cprofile_path else None
+
+    token = _current_profile.set(result)
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if profiler:
+            profiler.disable()
+        result.total_seconds = time.perf_counter() - start
+        _current_profile.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+        if profiler:
+            profiler.dump_stats(cprofile_path)
+
+@contextmanager
+def stage(name):
+    """Records wall time and allocations of the block as a stage of the active profile, if any."""
+    result = _current_profile.get()
+    if result is None:
+        yield
+        return
+
+    tracing = result.memory and tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        allocated_bytes = peak_bytes = None
+        if tracing:
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            allocated_bytes, peak_bytes = memory_after - memory_before, memory_peak - memory_before
+        result.stages.append(Stage(name, seconds, allocated_bytes, peak_bytes))
@@ -0,0 +1,139 @@
+"""Memory-mapped pixels of uncompressed images (PPM/PGM, BMP and uncompressed TIFF).
+
+Pixels of such images are stored as is, so instead of decoding the image into memory its pixel buffer is
+mapped and methods read it and write to it in place, tile by tile (see bit_utils.iter_flat_tiles); memory
+used doesn't depend on the image size. Compressed images (PNG, JPEG, compressed TIFF) aren't mapped.
+Embedding maps a copy of the cover, which becomes the stego image only when embedding succeeded (see edit_copy).
+"""
+from profiling import stage
+from PIL import Image
+import numpy as np
+import contextlib
+import os
+import shutil
+import uuid
+
+RAW_FORMATS = {"PPM", "BMP", "TIFF"}
+
+# Raw modes of pixel rows in the file by image mode; BGR rows (BMP) are mapped with reversed channels
+RAW_MODES = {"RGB": ("RGB", "BGR"), "L": ("L",)}
+
+def raw_layout(image, mode):
+    """(offset, row stride, bottom-up, BGR) of the pixel buffer of an opened image, or None if pixels aren't
+    stored uncompressed in one contiguous block."""
+    if image.format not in RAW_FORMATS or image.mode != mode or mode not in RAW_MODES:
+        return None
+
+    width, height = image.size
+    row_size = width * len(mode)
+    layout = None
+    next_row = next_offset = 0
+    for tile in sorted(image.tile, key=lambda tile: tile.extents[1]):
+        rawmode, stride, orientation = (tile.args, 0, 1) if isinstance(tile.args, str) else tile.args[:3]
+        left, top, right, bottom = tile.extents
+        if tile.codec_name != "raw" or rawmode not in RAW_MODES[mode] or (left, right) != (0, width):
+            return None
+        tile_layout = (stride or row_size, orientation < 0, rawmode == "BGR")
+        if layout is None:
+            layout = (tile.offset,) + tile_layout
+            next_offset = tile.offset
+        # Strips (TIFF) have to follow each other in the file
+        if top != next_row or tile.offset != next_offset or tile_layout != layout[1:]:
+            return None
+        next_row, next_offset = bottom, tile.offset + (bottom - top) * tile_layout[0]
+
+    if layout is None or next_row != height:
+        return None
+    return layout
+
+def map_pixels(image_path, mode="RGB", writable=False):
+    """Pixels of an uncompressed image as (height, width, 3) RGB or (height, width) array backed by the file,
+    or None if the image isn't an uncompressed image of that mode."""
+    try:
+        with Image.open(image_path) as image:
+            layout = raw_layout(image, mode)
+            width, height = image.size
+    except OSError:
+        return None  # Missing or unknown files are left to the usual loading and its errors
+    if layout is None:
+        return None
+
+    offset, stride, bottom_up, bgr = layout
+    buffer = np.memmap(image_path, dtype=np.uint8, mode="r+" if writable else "r", offset=offset, shape=(height, stride))
+    pixels = buffer[:, :width * len(mode)].reshape((height, width, 3) if mode == "RGB" else (height, width))
+    if bottom_up:
+        pixels = pixels[::-1]
+    if bgr:
+        pixels = pixels[..., ::-1]
+    return pixels
+
+def can_map_copy(image_path, output_path, mode="RGB"):
+    """True if the image is uncompressed and output_path asks for the same format, so that the cover can be
+    copied and embedded in place (see edit_copy)."""
+    try:
+        with Image.open(image_path) as image:
+            extension = os.path.splitext(os.fspath(output_path))[1].lower()
+            return raw_layout(image, mode) is not None and Image.registered_extensions().get(extension) == image.format
+    except OSError:
+        return False
+
+def edit_copy(function, image_path, output_path, mode="RGB"):
+    """Copies an uncompressed image to a temporary file next to output_path and calls function(pixels) with the
+    copy memory mapped for writing; returns what function returns.
+
+    The copy replaces output_path only once function succeeded and it's flushed, otherwise it's removed: a failed
+    embedding doesn't leave a cover copy or a half-written image behind, and output_path can be image_path itself.
+    """
+    directory, name = os.path.split(os.path.abspath(output_path))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    pixels = None
+    try:
+        with stage("load"):
+            shutil.copyfile(image_path, temp_path)
+            pixels = map_pixels(temp_path, mode, writable=True)
+        result = function(pixels)
+
+        with stage("encode-output"):
+            pixels.flush()
+            # Mapping is released before the copy is moved, mapped files can't be replaced on Windows
+            pixels = None
+            os.replace(temp_path, output_path)
+        return result
+    except BaseException:
+        pixels = None
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+def open_rgb_carrier(image_path):
+    """RGB pixels of an image for reading, memory mapped for uncompressed images (see map_pixels)."""
+    pixels = map_pixels(image_path)
+    if pixels is not None:
+        return pixels
+
+    image = Image.open(image_path)
+    if image.mode != 'RGB':
+        raise ValueError(f"Expected RGB image, got {image.mode}.")
+    return np.asarray(image)
+
+def edit_rgb_carrier(function, image_path, output_path):
+    """Calls function(pixels) to change RGB pixels of a cover image and saves them to output_path; returns what
+    function returns. Nothing is written to output_path if function fails.
+
+    Uncompressed covers saved in the same format aren't loaded, their mapped copy is changed in place (see
+    edit_copy); other images are decoded and saved by Pillow.
+    """
+    if can_map_copy(image_path, output_path):
+        return edit_copy(function, image_path, output_path)
+
+    with stage("load"):
+        image = Image.open(image_path)
+        if image.mode != 'RGB':
+            raise ValueError(f"Expected RGB image, got {image.mode}.")
+        pixels = np.array(image)
+    result = function(pixels)
+
+    with stage("encode-output"):
+        image.frombytes(pixels.tobytes())
+        image.save(output_path)
+    return result
@@ -1,71 +1,405 @@
-import matplotlib.pyplot as plt
+from diagnostics import ImageComparison
+from bit_utils import payload_bytes, payload_text
+from profiling import stage
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import logging
 import random
+import struct
 import json
-import cv2
+import os
+import zlib
 
 def calculate_capacity(image_path):
+    import cv2
+
     try:
-        possible_message_sizes = []
-        for i in range(1000,20,-25):
-            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            max_message_size = calculate_max_message_length(image, i)//8
-            possible_message_sizes.append((i, max_message_size))
-            logging.debug(f"For i={i}, max message size is {max_message_size} chars")
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        possible_message_sizes = [(i, max_bits//8) for i, max_bits in capacity_sweep(image)]
+        for i, max_message_size in possible_message_sizes:
+            logging.debug(f"For i={i}, max message size is {max_message_size} bytes")
         i_max, message_size = max(possible_message_sizes, key=lambda x: x[0] and x[1] > 0)
-        return f"Message size is={message_size} chars, achieved for block size={i_max}"
+        return f"Message size is={message_size} bytes, achieved for block size={i_max}"
     
     except Exception as e:
         raise Exception(f"Error during calculating capacity: {e}")
 
-def store_extract_data(peak_zero_positions, secret_length, seed, block_size, filename):
-    data = {
-        "peak_zero_positions": peak_zero_positions,
-        "secret_length": secret_length,
-        "seed": seed,
-        "block_size": block_size
-    }
-    
-    with open(filename, 'w') as file:
-        json.dump(data, file, indent=4)
+# Binary metadata: header (magic, version, flags, seed, block size, secret length in bits and number of visited
+# blocks), then bitmap of visited blocks used for data and peak and zero (uint8) of the used ones, zlib
+# compressed if the flag is set. Metadata files with .json extension are written as JSON, as by older versions.
+METADATA_MAGIC = b'RDHM'
+METADATA_VERSION = 1
+METADATA_COMPRESSED = 0x01
+METADATA_PCG64_KEYSTREAM = 0x02
+METADATA_HEADER = struct.Struct('>4sBBIIQI')
+
+# Keystreams XOR-ed with the hidden bits, generated from the seed: NumPy's PCG64 generator, or for metadata of
+# older versions (which don't name a keystream) the sequence of random.getrandbits(1) calls after random.seed(seed)
+KEYSTREAM_PCG64 = "pcg64"
+KEYSTREAM_MT19937 = "mt19937"
+
+# Outputs of Mersenne Twister taken at once by the compatible keystream
+KEYSTREAM_CHUNK_SIZE = 1 << 16
+
+
+def keystream_bits(seed, length, keystream=KEYSTREAM_PCG64):
+    """First length bits (uint8 array of 0/1) of the keystream generated from seed."""
+    if keystream == KEYSTREAM_PCG64:
+        generator = np.random.default_rng(seed)
+        return np.unpackbits(np.frombuffer(generator.bytes(-(-length // 8)), dtype=np.uint8))[:length]
+
+    if keystream == KEYSTREAM_MT19937:
+        # getrandbits(1) is the top bit of one 32-bit output of Mersenne Twister; getrandbits(32 * n) consumes
+        # n outputs, the first one in the least significant bits
+        generator = random.Random(seed)
+        chunks = []
+        for start in range(0, length, KEYSTREAM_CHUNK_SIZE):
+            count = min(KEYSTREAM_CHUNK_SIZE, length - start)
+            words = np.frombuffer(generator.getrandbits(32 * count).to_bytes(4 * count, 'little'), dtype='<u4')
+            chunks.append((words >> 31).astype(np.uint8))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)
+
+    raise ValueError(f"Unknown keystream '{keystream}'.")
+
+
+def peak_zero_arrays(peak_zero_positions):
+    """(used, peak, zero) arrays from a list of (peak, zero) positions of visited blocks, None for unused blocks."""
+    used = np.array([entry is not None for entry in peak_zero_positions], dtype=bool)
+    peak = np.array([entry[0] if entry is not None else 0 for entry in peak_zero_positions], dtype=np.uint8)
+    zero = np.array([entry[1] if entry is not None else 0 for entry in peak_zero_positions], dtype=np.uint8)
+    return used, peak, zero
+
+
+def peak_zero_list(used, peak, zero):
+    return [(p, z) if u else None for u, p, z in zip(used.tolist(), peak.tolist(), zero.tolist())]
+
+
+def store_extract_data(peak_zero_positions, secret_length, seed, block_size, filename, compress=True, keystream=KEYSTREAM_PCG64):
+    if keystream not in (KEYSTREAM_PCG64, KEYSTREAM_MT19937):
+        raise ValueError(f"Unknown keystream '{keystream}'.")
+
+    if os.fspath(filename).lower().endswith('.json'):
+        data = {
+            "peak_zero_positions": peak_zero_positions,
+            "secret_length": secret_length,
+            "seed": seed,
+            "block_size": block_size
+        }
+        if keystream != KEYSTREAM_MT19937:
+            data["keystream"] = keystream
+
+        with open(filename, 'w') as file:
+            json.dump(data, file, indent=4)
+    else:
+        used, peak, zero = peak_zero_arrays(peak_zero_positions)
+        body = np.packbits(used).tobytes() + peak[used].tobytes() + zero[used].tobytes()
+        flags = (METADATA_COMPRESSED if compress else 0) | (METADATA_PCG64_KEYSTREAM if keystream == KEYSTREAM_PCG64 else 0)
+        header = METADATA_HEADER.pack(METADATA_MAGIC, METADATA_VERSION, flags, seed, block_size, secret_length, len(used))
+
+        with open(filename, 'wb') as file:
+            file.write(header + (zlib.compress(body) if compress else body))
 
     logging.debug(f"Metadata successfully saved to {filename}.")
 
 
 def read_extract_data(filename):
-    with open(filename, 'r') as file:
-        data = json.load(file)
-    
-    peak_zero_positions = data.get("peak_zero_positions", [])
-    secret_length = data.get("secret_length", 0)
-    seed = data.get("seed", 0)
-    block_size = data.get("block_size", 0)
+    """Peak/zero positions of visited blocks as (used, peak, zero) arrays, secret length, seed, block size and
+    keystream; binary and JSON metadata files are told apart by their content."""
+    with open(filename, 'rb') as file:
+        data = file.read()
+
+    if not data.startswith(METADATA_MAGIC):
+        data = json.loads(data)
+        block_entries = peak_zero_arrays(data.get("peak_zero_positions", []))
+        secret_length = data.get("secret_length", 0)
+        seed = data.get("seed", 0)
+        block_size = data.get("block_size", 0)
+        keystream = data.get("keystream", KEYSTREAM_MT19937)
+    else:
+        _, version, flags, seed, block_size, secret_length, count = METADATA_HEADER.unpack_from(data)
+        if version != METADATA_VERSION:
+            raise ValueError(f"Unsupported metadata version {version}, expected {METADATA_VERSION}.")
+
+        keystream = KEYSTREAM_PCG64 if flags & METADATA_PCG64_KEYSTREAM else KEYSTREAM_MT19937
+        body = data[METADATA_HEADER.size:]
+        if flags & METADATA_COMPRESSED:
+            body = zlib.decompress(body)
+        bitmap_size = -(-count // 8)
+        used = np.unpackbits(np.frombuffer(body, dtype=np.uint8, count=min(bitmap_size, len(body))), count=count).astype(bool)
+        used_count = int(used.sum())
+        if len(body) != bitmap_size + 2 * used_count:
+            raise ValueError(f"Metadata is corrupted, expected {bitmap_size + 2 * used_count} bytes of block data, got {len(body)}.")
+
+        peak, zero = np.zeros(count, dtype=np.uint8), np.zeros(count, dtype=np.uint8)
+        peak[used] = np.frombuffer(body, dtype=np.uint8, count=used_count, offset=bitmap_size)
+        zero[used] = np.frombuffer(body, dtype=np.uint8, count=used_count, offset=bitmap_size + used_count)
+        block_entries = (used, peak, zero)
 
     logging.debug(f"Metadata successfully loaded from {filename}.")
-    return peak_zero_positions, secret_length, seed, block_size
+    return block_entries, secret_length, seed, block_size, keystream
 
 
-def calculate_max_message_length(image, block_size):
+def block_histograms(image, block_size):
+    """Histograms of all blocks (in raster order) as a (number of blocks, 256) array."""
     height, width = image.shape
-    max_bits = 0
+    block_cols = -(-width // block_size)
+    # Label every pixel with (block column, value), one bincount per row of blocks
+    column_labels = (np.arange(width, dtype=np.int32) // block_size) * 256
 
+    histograms = []
     for row in range(0, height, block_size):
-        for col in range(0, width, block_size):
-            block = image[row:row + block_size, col:col + block_size]
-            hist, _ = np.histogram(block, bins=range(257))
+        strip = image[row:row + block_size]
+        labels = column_labels + strip
+        histograms.append(np.bincount(labels.ravel(), minlength=block_cols * 256).reshape(block_cols, 256))
+
+    return np.concatenate(histograms)
+
+
+def find_peak_zero(histograms):
+    """Peak and zero position of every block histogram and whether the block can hide data."""
+    peak = np.argmax(histograms, axis=1)
+    empty = histograms == 0
+    zero = np.argmax(empty, axis=1) # Find zero position, if possible
+    usable = empty.any(axis=1) & (peak < zero) # Check if it is possible to hide data in block
+    return peak, zero, usable
+
+
+def calculate_max_message_length(image, block_size):
+    histograms = block_histograms(image, block_size)
+    peak, _, usable = find_peak_zero(histograms)
+    peak_count = histograms[np.arange(len(histograms)), peak]
+    return int(peak_count[usable].sum())
+
+
+# Block sizes checked when looking for the best block size
+BLOCK_SIZES = range(1000, 20, -25)
+
+
+def integral_histogram(image, tile_size):
+    """Summed-area table of tile histograms, entry [r, c] is histogram of image[:r*tile_size, :c*tile_size]."""
+    tile_rows, tile_cols = -(-image.shape[0] // tile_size), -(-image.shape[1] // tile_size)
+    integral = np.zeros((tile_rows + 1, tile_cols + 1, 256), dtype=np.int64)
+    integral[1:, 1:] = block_histograms(image, tile_size).reshape(tile_rows, tile_cols, 256)
+    return integral.cumsum(axis=0).cumsum(axis=1)
+
+
+def block_histograms_from_integral(integral, tiles_per_block):
+    """Histograms of all blocks made of tiles_per_block x tiles_per_block tiles (in raster order)."""
+    tile_rows, tile_cols = integral.shape[0] - 1, integral.shape[1] - 1
+    row_edges = np.append(np.arange(0, tile_rows, tiles_per_block), tile_rows)
+    col_edges = np.append(np.arange(0, tile_cols, tiles_per_block), tile_cols)
+
+    top, bottom = row_edges[:-1, None], row_edges[1:, None]
+    left, right = col_edges[None, :-1], col_edges[None, 1:]
+    histograms = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    return histograms.reshape(-1, 256)
+
+
+def capacity_sweep(image, block_sizes=BLOCK_SIZES):
+    """Maximum message length in bits for every block size as a list of (block_size, max_bits).
+
+    Block histograms for all sizes are read from one integral histogram built over tiles of the
+    greatest common divisor of block sizes (25 for BLOCK_SIZES), so the image is scanned only once.
+    """
+    block_sizes = list(block_sizes)
+    tile_size = int(np.gcd.reduce(block_sizes))
+    integral = integral_histogram(image, tile_size)
+
+    possible_message_sizes = []
+    for block_size in block_sizes:
+        histograms = block_histograms_from_integral(integral, block_size // tile_size)
+        peak, _, usable = find_peak_zero(histograms)
+        peak_count = histograms[np.arange(len(histograms)), peak]
+        possible_message_sizes.append((block_size, int(peak_count[usable].sum())))
+
+    return possible_message_sizes
+
+
+def split_into_blocks(image, block_size):
+    """Reshapes image into (number of blocks, block_size**2) array, each row is one block in raster order.
+
+    Border blocks are padded, the returned mask marks real pixels.
+    """
+    height, width = image.shape
+    block_rows, block_cols = -(-height // block_size), -(-width // block_size)
+
+    padded = np.zeros((block_rows * block_size, block_cols * block_size), dtype=image.dtype)
+    padded[:height, :width] = image
+    valid = np.zeros(padded.shape, dtype=bool)
+    valid[:height, :width] = True
+
+    def to_blocks(array):
+        blocks = array.reshape(block_rows, block_size, block_cols, block_size).swapaxes(1, 2)
+        return np.ascontiguousarray(blocks).reshape(block_rows * block_cols, -1)
+
+    return to_blocks(padded), to_blocks(valid)
+
+
+def merge_blocks(blocks, image_shape, block_size):
+    height, width = image_shape
+    block_rows, block_cols = -(-height // block_size), -(-width // block_size)
+    padded = blocks.reshape(block_rows, block_cols, block_size, block_size).swapaxes(1, 2)
+    return np.ascontiguousarray(padded.reshape(block_rows * block_size, block_cols * block_size)[:height, :width])
+
+
+def visited_blocks(last_block, block_rows, block_cols):
+    """Indices of blocks visited while hiding data which ended in last_block.
+
+    All blocks up to last_block are visited and then the first block of every following row of blocks
+    (these are only shifted, not used for data); extraction walks the blocks in the same order.
+    """
+    last_row = last_block // block_cols
+    following_rows = np.arange(last_row + 1, block_rows) * block_cols
+    return np.concatenate((np.arange(last_block + 1), following_rows))
+
+
+def block_row_bands(block_rows, block_cols, block_size, workers):
+    """(pixel rows, blocks) slices of bands of whole block rows for a thread pool, a few bands per worker so that
+    bands with more carriers than others even out."""
+    band_count = min(block_rows, 4 * workers)
+    bounds = [block_rows * band // band_count for band in range(band_count + 1)]
+    return [(slice(first * block_size, stop * block_size), slice(first * block_cols, stop * block_cols))
+            for first, stop in zip(bounds, bounds[1:])]
+
+
+def map_bands(function, bands, workers):
+    """Results of function(band) for the bands in order, computed concurrently on a thread pool (NumPy releases
+    the GIL in array operations). Bands don't overlap, so function can write to its rows of an image."""
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(function, bands))
+
+
+def bit_offsets(carrier_counts, length):
+    """Index of the first hidden bit of every block (and the end of the last one), from numbers of carriers."""
+    return np.minimum(np.concatenate(([0], np.cumsum(carrier_counts))), length)
 
-            peak = np.argmax(hist)
-            zero = np.where(hist == 0)[0][0] if np.any(hist == 0) else None # Find zero position, if possible
 
-            if zero is not None and peak < zero: # Check if it is possible to hide data in block
-                peak_count = hist[peak]
-                max_bits += peak_count
+def embed_blocks(image, block_size, used, peak, zero, secret_bits):
+    """Shifts histograms of used blocks and hides secret_bits in their peak pixels, in one vectorized pass over
+    all blocks of image; returns stego image."""
+    blocks, valid = split_into_blocks(image, block_size)
+    block_peak, block_zero = peak[:, None], zero[:, None]
+    active = used[:, None] & valid
 
-    return max_bits
+    # Shift pixels between peak and zero up to make space
+    blocks[active & (blocks > block_peak) & (blocks < block_zero)] += 1
+
+    # Hiding data - peak pixels in block order are carriers ('0' stays peak, '1' becomes peak+1)
+    carriers = np.flatnonzero(active & (blocks == block_peak))[:len(secret_bits)]
+    blocks.ravel()[carriers] += secret_bits.astype(blocks.dtype)
+
+    return merge_blocks(blocks, image.shape, block_size)
+
+
+def shift_and_embed(image, block_size, secret_bits, workers=1):
+    """Shifts histograms and hides secret_bits (array of 0/1) in peak pixels; returns stego image, peak/zero positions and visited blocks.
+
+    Blocks depend on each other only through the number of bits hidden in blocks before them, a prefix sum of
+    their capacities. With more workers bands of block rows are then embedded concurrently, each in a vectorized
+    pass starting at its bit offset; otherwise all blocks at once.
+    """
+    height, width = image.shape
+    block_rows, block_cols = -(-height // block_size), -(-width // block_size)
+
+    histograms = block_histograms(image, block_size)
+    peak, zero, usable = find_peak_zero(histograms)
+    capacity = np.where(usable, histograms[np.arange(len(histograms)), peak], 0)
+
+    # Stop at the block in which whole message is hidden
+    last_block = int(np.searchsorted(np.cumsum(capacity), len(secret_bits)))
+    if last_block >= len(capacity):
+        raise ValueError(f"Message is too long to be hidden in the image. Maximum size is {int(capacity.sum())}")
+    visited = visited_blocks(last_block, block_rows, block_cols)
+
+    used = np.zeros(len(histograms), dtype=bool)
+    used[visited] = usable[visited]
+    peak_zero_positions = [(int(peak[i]), int(zero[i])) if used[i] else None for i in visited]
+
+    if workers > 1:
+        stego_image = image.copy()
+        offsets = bit_offsets(np.where(used, capacity, 0), len(secret_bits))
+
+        def embed_band(band):
+            rows, blocks = band
+            band_bits = secret_bits[offsets[blocks.start]:offsets[blocks.stop]]
+            stego_image[rows] = embed_blocks(image[rows], block_size, used[blocks], peak[blocks], zero[blocks], band_bits)
+
+        # Bands without used blocks stay as they are
+        bands = [band for band in block_row_bands(block_rows, block_cols, block_size, workers) if used[band[1]].any()]
+        map_bands(embed_band, bands, workers)
+        return stego_image, peak_zero_positions, visited
+
+    return embed_blocks(image, block_size, used, peak, zero, secret_bits), peak_zero_positions, visited
+
+
+def extract_blocks(image, block_size, used, peak, zero, length):
+    """Reads length hidden bits from used blocks and reverses their histogram shifting, in one vectorized pass
+    over all blocks of image; returns bits and recovered image."""
+    blocks, valid = split_into_blocks(image, block_size)
+    active = used[:, None] & valid
+
+    # Extract hidden data, peak is carrier of '0', peak+1 is carrier of '1'
+    carriers = np.flatnonzero(active & ((blocks == peak[:, None]) | (blocks == peak[:, None] + 1)))[:length]
+    bits = (blocks.ravel()[carriers] != peak[carriers // blocks.shape[1]]).astype(np.uint8)
+
+    # Reverse the histogram shifting
+    blocks[active & (blocks > peak[:, None]) & (blocks <= zero[:, None])] -= 1
+
+    return bits, merge_blocks(blocks, image.shape, block_size)
+
+
+def extract_and_restore(image, block_size, block_entries, secret_length, workers=1):
+    """Reads secret_length hidden bits (array of 0/1) and reverses histogram shifting; returns bits, recovered image and visited blocks.
+
+    block_entries are (used, peak, zero) arrays of visited blocks, as loaded by read_extract_data.
+
+    As in shift_and_embed, with more workers bands of block rows are processed concurrently once bit offsets of
+    blocks are known.
+    """
+    height, width = image.shape
+    block_rows, block_cols = -(-height // block_size), -(-width // block_size)
+    block_count = block_rows * block_cols
+
+    used, peak, zero = (entries[:block_count] for entries in block_entries)
+    peak, zero = peak.astype(np.int64), zero.astype(np.int64)
+
+    # Find block in which the message ends; pixels equal to peak or peak+1 are carriers
+    all_histograms = block_histograms(image, block_size)
+    histograms = all_histograms[:len(used)]
+    carrier_count = np.where(used, histograms[np.arange(len(used)), peak] + histograms[np.arange(len(used)), peak + 1], 0)
+    last_block = min(int(np.searchsorted(np.cumsum(carrier_count), secret_length)), len(used) - 1)
+    visited = visited_blocks(last_block, block_rows, block_cols)[:len(used)]
+    count = len(visited)
+
+    block_used = np.zeros(block_count, dtype=bool)
+    block_peak = np.zeros(block_count, dtype=np.int64)
+    block_zero = np.zeros(block_count, dtype=np.int64)
+    block_used[visited], block_peak[visited], block_zero[visited] = used[:count], peak[:count], zero[:count]
+
+    if workers > 1:
+        recovered_image = image.copy()
+        all_blocks = np.arange(block_count)
+        block_carriers = all_histograms[all_blocks, block_peak] + all_histograms[all_blocks, block_peak + 1]
+        offsets = bit_offsets(np.where(block_used, block_carriers, 0), secret_length)
+
+        def extract_band(band):
+            rows, blocks = band
+            bits, recovered_image[rows] = extract_blocks(image[rows], block_size, block_used[blocks], block_peak[blocks],
+                                                         block_zero[blocks], offsets[blocks.stop] - offsets[blocks.start])
+            return bits
+
+        # Bands without used blocks hold no bits and stay as they are
+        bands = [band for band in block_row_bands(block_rows, block_cols, block_size, workers) if block_used[band[1]].any()]
+        bits = map_bands(extract_band, bands, workers)
+        return np.concatenate(bits) if bits else np.empty(0, dtype=np.uint8), recovered_image, visited
+
+    bits, recovered_image = extract_blocks(image, block_size, block_used, block_peak, block_zero, secret_length)
+    return bits, recovered_image, visited
 
 
 def plot_histogram(block, title):
+    import matplotlib.pyplot as plt
+
     hist, bins = np.histogram(block, bins=range(257))
     plt.figure()
     plt.bar(bins[:-1], hist, width=1, edgecolor='black')
@@ -76,160 +410,129 @@ def plot_histogram(block, title):
     plt.show()
 
 
-def embed_message(image_path, secret_message, output_path, metadata_path):
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+def plot_block_histograms(before, after, block_size, visited, peak_zero_positions, titles):
+    """Plots histograms of every used block before and after processing."""
+    block_cols = -(-before.shape[1] // block_size)
+    for block_index, peak_zero in zip(visited, peak_zero_positions):
+        if peak_zero is not None:
+            row, col = (block_index // block_cols) * block_size, (block_index % block_cols) * block_size
+            plot_histogram(before[row:row + block_size, col:col + block_size], titles[0])
+            plot_histogram(after[row:row + block_size, col:col + block_size], titles[1])
+
+
+def embed_message(image_path, secret_message, output_path, metadata_path, diagnostics=True, workers=1, keystream=KEYSTREAM_PCG64):
+    import cv2
+
+    with stage("load"):
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
     try:
-        possible_message_sizes = []
-        for i in range(1000,20,-25):
-            max_message_size = calculate_max_message_length(image, i)//8
-            possible_message_sizes.append((i, max_message_size))
-            logging.debug(f"For i={i}, max message size is {max_message_size} chars")
-        block_size, message_size = max(possible_message_sizes, key=lambda x: x[0] and x[1] > 0)
-        logging.info(f"Message size is={message_size} chars, achieved for block size={block_size}")
+        with stage("locate-carriers"):
+            max_bits_for_size = capacity_sweep(image)
+            possible_message_sizes = [(i, max_bits//8) for i, max_bits in max_bits_for_size]
+            for i, max_message_size in possible_message_sizes:
+                logging.debug(f"For i={i}, max message size is {max_message_size} bytes")
+            block_size, message_size = max(possible_message_sizes, key=lambda x: x[0] and x[1] > 0)
+            logging.info(f"Message size is={message_size} bytes, achieved for block size={block_size}")
     except Exception as e:
         raise Exception(f"Error during calculating possible: {e}")
 
-    if message_size >= len(secret_message):
-        try:
-            height, width = image.shape
-            # Generate random seed and set it 
-            seed = random.randint(0, 10000000)
-            random.seed(seed)
+    # Message can be text, bytes or file-like object; its length is kept in metadata, so it needs no frame
+    payload = payload_bytes(secret_message)
 
-            # Generate random bits sequence
-            random_sequence = ''.join(format(random.getrandbits(1), 'b') for _ in range(len(secret_message)*8))
+    if message_size >= len(payload):
+        try:
+            with stage("encode-payload"):
+                # Generate random seed and the keystream from it
+                seed = random.randint(0, 10000000)
+                random_bits = keystream_bits(seed, len(payload) * 8, keystream)
 
-            # Convert secret message to bits
-            text_bits = ''.join(format(ord(char), '08b') for char in secret_message)
-            
-            # XOR original text with random bits sequence
-            secret_bits = ''.join(str(int(random_sequence[i]) ^ int(text_bits[i])) for i in range(len(text_bits)))
-            logging.debug(f"Secret bits:\n{secret_bits}")
+                # Convert secret message to bits
+                text_bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+                
+                # XOR original text with random bits sequence
+                secret_bits = text_bits ^ random_bits
+                logging.debug(f"Secret bits:\n{secret_bits}")
             
-            max_length_bits = calculate_max_message_length(image, block_size)
+            max_length_bits = dict(max_bits_for_size)[block_size]
             
             if len(secret_bits) > max_length_bits:
                 raise ValueError(f"Message is too long to be hidden in the image. Maximum size is {max_length_bits}")
 
-            peak_zero_positions = []
-            bit_index = 0  # bit index for message to hide
-
-            for row in range(0, height, block_size):
-                for col in range(0, width, block_size):
-                    block = image[row:row + block_size, col:col + block_size]
-                    hist, _ = np.histogram(block, bins=range(257))
-                    # Find peak and zero positions
-                    peak = np.argmax(hist)
-                    zero = np.where(hist == 0)[0][0] if np.any(hist == 0) else None
-
-                    if zero is not None and peak < zero: # Check if it is possible to hide data in block
-                        plot_histogram(block, "Histogram before shift")
-                        for i in range(block.shape[0]):
-                            for j in range(block.shape[1]):
-                                if block[i, j] > peak and block[i, j] < zero:
-                                    block[i, j] += 1  # Przesunięcie wartości pikseli w górę, aby zrobić miejsce
-
-                        # Hiding data
-                        for i in range(block.shape[0]):
-                            for j in range(block.shape[1]):
-                                if bit_index >= len(secret_bits):
-                                    break
-                                if block[i, j] == peak:  # '0' carrier
-                                    if secret_bits[bit_index] == '1':
-                                        block[i, j] += 1  # Change value to peak+1 for bit '1'
-                                    bit_index += 1
-
-                        plot_histogram(block, "Histogram after shift")
-                        peak_zero_positions.append((int(peak), int(zero)))
-                    else:
-                        peak_zero_positions.append(None)
-
-                    image[row:row + block_size, col:col + block_size] = block
-
-                    if bit_index >= len(secret_bits): # Stop when whole message is hidden
-                        break
-
-            store_extract_data(peak_zero_positions, len(secret_bits), seed, block_size, metadata_path)
-            cv2.imwrite(output_path, image)
+            with stage("embed"):
+                stego_image, peak_zero_positions, visited = shift_and_embed(image, block_size, secret_bits, workers)
+
+            if diagnostics:
+                with stage("diagnostics"):
+                    plot_block_histograms(image, stego_image, block_size, visited, peak_zero_positions,
+                                          ("Histogram before shift", "Histogram after shift"))
+
+            image = stego_image
+
+            with stage("encode-output"):
+                store_extract_data(peak_zero_positions, len(secret_bits), seed, block_size, metadata_path, keystream=keystream)
+                cv2.imwrite(output_path, image)
             logging.debug(f"Stego image saved to {output_path}")
+            return ImageComparison(image_path, output_path)
            
         except Exception as e:
             raise Exception(f"Error during extracting: {e}")
     else:
-        raise Exception(f"Message size={message_size} [chars], achieved for block size={block_size} was not sufficient to hide secret data. Secret data size = {len(secret_message)}")
+        raise Exception(f"Message size={message_size} [bytes], achieved for block size={block_size} was not sufficient to hide secret data. Secret data size = {len(payload)}")
 
-def extract_message(image_path, metadata_file):
-    try:
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        peak_zero_positions, secret_length, seed, block_size = read_extract_data(metadata_file)
+def save_recovered_image(image, output_path, encoder_params=None):
+    """Writes a recovered cover image; encoder_params are OpenCV imwrite flags and values,
+    e.g. [cv2.IMWRITE_PNG_COMPRESSION, 1] for faster PNG encoding."""
+    import cv2
 
-        height, width = image.shape
-        extracted_bits = []
-        bit_index = 0
-        peak_zero_used_index = 0
+    with stage("encode-output"):
+        if not cv2.imwrite(output_path, image, list(encoder_params or [])):
+            raise ValueError(f"Could not write recovered image to {output_path}.")
+    logging.debug(f"Recovered image saved to {output_path}")
 
-        # Extract data and restore the original
-        for row in range(0, height, block_size):
-            for col in range(0, width, block_size):
-                if peak_zero_used_index >= len(peak_zero_positions):
-                    break  # No more peak/zero data
-
-                peak_zero = peak_zero_positions[peak_zero_used_index]
-
-                if peak_zero is None: # Block was not used for data hiding
-                    peak_zero_used_index += 1
-                    continue
-
-                peak, zero = peak_zero
-                block = image[row:row + block_size, col:col + block_size]
-
-                # Display the histogram before reversing
-                plot_histogram(block, "Histogram before reversing shift")
-
-                # Extract hidden data from this block
-                for i in range(block.shape[0]):
-                    for j in range(block.shape[1]):
-                        if bit_index >= secret_length:
-                            break
-                        if block[i, j] == peak:  # Carrier of '0'
-                            extracted_bits.append('0')
-                            bit_index += 1
-                        elif block[i, j] == peak + 1:  # Carrier of '1'
-                            extracted_bits.append('1')
-                            bit_index += 1
-
-                # Reverse the histogram shifting for this block
-                for i in range(block.shape[0]):
-                    for j in range(block.shape[1]):
-                        if peak < block[i, j] <= zero: 
-                            block[i, j] -= 1
-                
-                # Display the histogram after reversing
-                plot_histogram(block, "Histogram after reversing shift")
+def recover_bytes(image_path, metadata_file, diagnostics=True, workers=1, output_path=None, encoder_params=None):
+    """Extracts the message as bytes and restores the cover image; returns both (image as grayscale array).
+    Recovered image is written only if output_path is given (see save_recovered_image)."""
+    import cv2
 
-                image[row:row + block_size, col:col + block_size] = block
-                peak_zero_used_index += 1
-
-                if bit_index >= secret_length:
-                    break
+    try:
+        with stage("load"):
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            block_entries, secret_length, seed, block_size, keystream = read_extract_data(metadata_file)
 
-        ciphered_sequence = ''.join(extracted_bits)
+        # Extract data and restore the original
+        with stage("extract"):
+            extracted_bits, recovered_image, visited = extract_and_restore(image, block_size, block_entries, secret_length, workers)
 
-        # Use seed to generate the random sequence
-        random.seed(seed)
-        random_sequence = ''.join(format(random.getrandbits(1), 'b') for _ in range(secret_length))
+        if diagnostics:
+            with stage("diagnostics"):
+                plot_block_histograms(image, recovered_image, block_size, visited, peak_zero_list(*block_entries),
+                                      ("Histogram before reversing shift", "Histogram after reversing shift"))
 
-        # XOR the extracted ciphered sequence with the random sequence
-        original_bits = ''.join(str(int(ciphered_sequence[i]) ^ int(random_sequence[i])) for i in range(secret_length))
+        image = recovered_image
+        with stage("decode-payload"):
+            # Use seed to generate the keystream named in metadata
+            random_bits = keystream_bits(seed, secret_length, keystream)
 
-        # Convert the original bits into the original message
-        original_message = ''.join(chr(int(original_bits[i:i+8], 2)) for i in range(0, len(original_bits), 8))
+            # XOR the extracted ciphered sequence with the random sequence, bits form bytes of the original message
+            original_message = np.packbits(extracted_bits ^ random_bits).tobytes()
+        logging.debug(f"Extracted message: {original_message}")
 
-        cv2.imwrite("rdh_recovered.png", image)
-        logging.debug("Extracted message:", original_message)
-        logging.debug("Recovered image saved as 'rdh_recovered.png'")
+        if output_path is not None:
+            save_recovered_image(image, output_path, encoder_params)
 
-        return f"{original_message}\n\nReversed image saved to: rdh_recovered.png"
+        return original_message, image
 
     except Exception as e:
         raise Exception(f"Error during extracting: {e}")
+
+def recover_message(image_path, metadata_file, diagnostics=True, workers=1, output_path=None, encoder_params=None):
+    """Extracts the message as text and restores the cover image; returns both (see recover_bytes)."""
+    payload, image = recover_bytes(image_path, metadata_file, diagnostics, workers, output_path, encoder_params)
+    return payload_text(payload), image
+
+def extract_message(image_path, metadata_file, diagnostics=True, workers=1, output_path=None, encoder_params=None):
+    """Extracts the message as text; the recovered cover image is saved to output_path, if given."""
+    original_message, _ = recover_message(image_path, metadata_file, diagnostics, workers, output_path, encoder_params)
+    if output_path is None:
+        return original_message
+    return f"{original_message}\n\nReversed image saved to: {output_path}"
@@ -1,101 +1,65 @@
-from custom_chaos_implementation import compare_images
+from diagnostics import compare_images
+from bit_utils import FRAME_HEADER_SIZE, check_capacity, edit_tiles, framed_chunks, payload_text, read_bit_frame, run_tiles
+from profiling import stage
+from raw_carrier import edit_rgb_carrier, open_rgb_carrier
 from PIL import Image
+import numpy as np
 
 def calculate_capacity_return_number(image_path):
     try:
         image = Image.open(image_path)
         width, height = image.size
-        capacity = (((width*height*3)//8)-1)
+        capacity = (((width*height*3)//8)-FRAME_HEADER_SIZE)
         return capacity
     except Exception as e:
         raise Exception(f"Error during calculating capacity: {e}")
 
 def calculate_capacity(image_path):
     capacity = calculate_capacity_return_number(image_path)
-    return f"Maximum message size is {capacity} chars."
+    return f"Maximum message size is {capacity} bytes."
 
-# Set LSB bit
-def set_lsb(value, bit):
-    return (value & ~1) | bit
-
-def embed_message(image_path, message, output_path):
+def embed_message(image_path, message, output_path, diagnostics=True, workers=1):
     try:
+        # Step 1: Capacity is checked before anything is written (streams are checked while being read)
         capacity = calculate_capacity_return_number(image_path)
+        check_capacity(message, capacity)
 
-        if (capacity < len(message)):
-            raise Exception(f"Couldn't embed {len(message)} chars in the image. Max capacity is: {capacity}.")
-
-        # Step 1: Convert message to bits
-        message_bits = ''.join(format(ord(char), '08b') for char in message + '\0')
-
-        # Step 2: Load image
-        image = Image.open(image_path)
-        pixels = image.load()
-        width, height = image.size
-
-        bit_index = 0
-
-        # Step 3: LSB
-        for y in range(height):
-            for x in range(width):
-                if bit_index >= len(message_bits):
-                    break
-
-                r, g, b = pixels[x, y]
+        # Step 2: Message (text, bytes or binary stream read piece by piece) is hidden chunk by chunk
+        def embed_payload(pixels):
+            for offset, chunk in framed_chunks(message, capacity):
+                with stage("encode-payload"):
+                    message_bits = np.unpackbits(chunk)
 
-                # Change LSB in R channel
-                r = set_lsb(r, int(message_bits[bit_index]))
-                bit_index += 1
+                # Step 3: LSB (R, G, B channels of consecutive pixels in raster order), tile by tile - bit k goes
+                # to value k, so tiles are independent and with more workers embedded concurrently
+                def embed_tile(index, carriers):
+                    carriers[:] = (carriers & 0xFE) | message_bits[index:index + len(carriers)]
 
-                # Change LSB in G channel
-                if bit_index < len(message_bits):
-                    g = set_lsb(g, int(message_bits[bit_index]))
-                    bit_index += 1
+                with stage("embed"):
+                    edit_tiles(embed_tile, pixels, offset * 8, offset * 8 + len(message_bits), workers)
 
-                # Change LSB in B channel
-                if bit_index < len(message_bits):
-                    b = set_lsb(b, int(message_bits[bit_index]))
-                    bit_index += 1
-
-                pixels[x, y] = (r, g, b)
-
-        image.save(output_path)
-        compare_images(image_path, output_path)
+        # Step 4: Load the image, embed and save it (uncompressed images are embedded in place, see raw_carrier.edit_rgb_carrier)
+        edit_rgb_carrier(embed_payload, image_path, output_path)
+        return compare_images(image_path, output_path, diagnostics)
 
     except Exception as e:
         raise Exception(f"Error during embeding: {e}")
 
-def extract_message(stego_image_path):
+def extract_bytes(stego_image_path, workers=1):
     try:
-        # Step 1: Load image
-        image = Image.open(stego_image_path)
-        pixels = image.load()
-        width, height = image.size
-
-        binary_message = []
+        # Step 1: Load image (uncompressed images are memory mapped)
+        with stage("load"):
+            pixels = open_rgb_carrier(stego_image_path)
 
-        # Step 2: LSB
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-
-                # Read LSB from R, G, B
-                binary_message.append(str(r & 1))
-                binary_message.append(str(g & 1))
-                binary_message.append(str(b & 1))
-
-        # Step 3: Convert bits to ASCII 
-        message = ''
-        for i in range(0, len(binary_message), 8):
-            byte = binary_message[i:i + 8]
-            if len(byte) == 8:
-                char = chr(int(''.join(byte), 2))
-                # Check for end of message
-                if char == '\0':
-                    break
-                message += char
-
-        return message
+        # Step 2: LSB, decoded tile by tile (concurrently with more workers) until end of message
+        with stage("extract"):
+            lsb_chunks = run_tiles(lambda index, chunk: chunk & 1, pixels, workers=workers)
+            return read_bit_frame(lsb_chunks)
 
     except Exception as e:
-        raise Exception(f"Error during extracting: {e}")
\ No newline at end of file
+        raise Exception(f"Error during extracting: {e}")
+
+def extract_message(stego_image_path, workers=1):
+    payload = extract_bytes(stego_image_path, workers)
+    with stage("decode-payload"):
+        return payload_text(payload)
\ No newline at end of file